@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""Реестр MCP-действий.
+
+Каждое действие — обработчик с pydantic-моделью параметров. Параметры
+проверяются один раз при вызове :func:`resolve`, обработчик получает
+уже готовую модель и возвращает ``data`` ответа. Для действий с
+постраничными результатами дополнительно регистрируется функция
+``stream``, возвращающая асинхронный итератор записей.
+
+Из моделей строится описание инструментов для ``tools/list``.
+"""
+
+import os
+import inspect
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Tuple, Type, Union
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, ValidationError
+
+from mirror import cursor_offset, is_mirror_cursor, mirror
+from pipeline import PipelineError, run_pipeline
+from search_index import search_index
+from notion_client import (
+    create_page,
+    create_task,
+    update_page,
+    query_database,
+    iter_database,
+    iter_block_children,
+    iter_search,
+    retrieve_page,
+    archive_page,
+    delete_block,
+    append_block_children,
+    retrieve_block_children,
+    retrieve_block_tree,
+    retrieve_database,
+    search,
+)
+
+# Сколько команд пакета или шагов конвейера выполняется одновременно;
+# частоту запросов к Notion всё равно ограничивает общий планировщик.
+BATCH_CONCURRENCY = int(os.getenv("MCP_BATCH_CONCURRENCY", "10"))
+
+
+@dataclass(frozen=True)
+class Action:
+    name: str
+    params: Type[BaseModel]
+    handler: Callable[[Any], Awaitable[Any]]
+    description: str
+    stream: Optional[Callable[[Any], AsyncIterator[Dict[str, Any]]]] = None
+
+
+ACTIONS: Dict[str, Action] = {}
+
+
+def action(name: str, params: Type[BaseModel], stream: Optional[Callable] = None):
+    """Зарегистрировать обработчик действия ``name``."""
+
+    def register(handler):
+        ACTIONS[name] = Action(name, params, handler, inspect.getdoc(handler) or "", stream)
+        return handler
+
+    return register
+
+
+def resolve(name: str, parameters: Dict[str, Any]) -> Tuple[Action, BaseModel]:
+    """Найти действие и проверить его параметры.
+
+    Неизвестное действие и некорректные параметры дают ошибку 400.
+    """
+    found = ACTIONS.get(name)
+    if found is None:
+        raise HTTPException(status_code=400, detail=f"unknown action: {name}")
+    try:
+        return found, found.params.model_validate(parameters)
+    except ValidationError as exc:
+        raise HTTPException(
+            status_code=400,
+            detail=[f"{'.'.join(map(str, e['loc'])) or name}: {e['msg']}" for e in exc.errors()],
+        )
+
+
+def list_tools() -> List[Dict[str, Any]]:
+    """Описание действий в формате MCP ``tools/list``."""
+    return [
+        {"name": a.name, "description": a.description, "inputSchema": a.params.model_json_schema()}
+        for a in ACTIONS.values()
+    ]
+
+
+# ---------- модели параметров ----------
+class PaginationParams(BaseModel):
+    page_size: Optional[int] = Field(None, ge=1, le=100)
+    start_cursor: Optional[str] = None
+    all: bool = False
+    limit: Optional[int] = Field(None, ge=1)
+    stream: Union[bool, Literal["ndjson", "sse"]] = False
+
+
+class CreatePageParams(BaseModel):
+    title: str = "Untitled"
+    idempotency_key: Optional[str] = None
+
+
+class CreateTaskParams(BaseModel):
+    title: str = "Untitled"
+    due_date: Optional[str] = Field(None, description="YYYY-MM-DD")
+    idempotency_key: Optional[str] = None
+
+
+class UpdatePageParams(BaseModel):
+    page_id: str
+    properties: Dict[str, Any]
+    database_id: Optional[str] = None
+    idempotency_key: Optional[str] = None
+
+
+class QueryDatabaseParams(PaginationParams):
+    filter: Optional[Dict[str, Any]] = None
+    sorts: Optional[List[Dict[str, Any]]] = None
+    source: Literal["auto", "notion", "mirror"] = Field(
+        "auto", description="auto — локальная копия, если она свежая и может ответить"
+    )
+
+
+class PageParams(BaseModel):
+    page_id: str
+
+
+class ArchivePageParams(PageParams):
+    archived: bool = True
+
+
+class BlockParams(BaseModel):
+    block_id: str
+
+
+class AppendBlockChildrenParams(BlockParams):
+    children: List[Dict[str, Any]]
+    after: Optional[str] = None
+    idempotency_key: Optional[str] = None
+
+
+class BlockChildrenParams(BlockParams, PaginationParams):
+    pass
+
+
+class BlockTreeParams(BlockParams):
+    max_depth: Optional[int] = Field(None, ge=1)
+    concurrency: Optional[int] = Field(None, ge=1)
+    format: Literal["nested", "flat"] = "nested"
+    include_child_pages: bool = False
+
+
+class RetrieveDatabaseParams(BaseModel):
+    database_id: str
+    refresh: bool = False
+
+
+class RefreshSchemaParams(BaseModel):
+    database_id: Optional[str] = None
+
+
+class SearchParams(PaginationParams):
+    query: str = Field(min_length=1)
+    filter: Optional[Dict[str, Any]] = None
+    sort: Optional[Dict[str, Any]] = None
+
+
+class LocalSearchParams(BaseModel):
+    query: str = Field(min_length=1)
+    kind: Optional[Literal["page", "database", "block"]] = None
+    limit: int = Field(20, ge=1, le=100)
+
+
+class PipelineParams(BaseModel):
+    steps: List[Dict[str, Any]] = Field(min_length=1)
+
+
+# ---------- обработчики ----------
+@action("create_page", CreatePageParams)
+async def create_page_action(p: CreatePageParams):
+    """Создать страницу внутри NOTION_PAGE_ID."""
+    return await create_page(p.title, p.idempotency_key)
+
+
+@action("create_task", CreateTaskParams)
+async def create_task_action(p: CreateTaskParams):
+    """Создать задачу в базе NOTION_DATABASE_ID."""
+    return await create_task(p.model_dump())
+
+
+@action("update_page", UpdatePageParams)
+async def update_page_action(p: UpdatePageParams):
+    """Изменить свойства страницы."""
+    return await update_page(p.model_dump())
+
+
+def _use_mirror(p: QueryDatabaseParams) -> bool:
+    if is_mirror_cursor(p.start_cursor):
+        # курсор копии Notion не примет — продолжить можно только из копии
+        if cursor_offset(p.start_cursor) is None:
+            raise HTTPException(status_code=400, detail=f"invalid start_cursor: {p.start_cursor}")
+        if p.source == "notion" or mirror is None or not mirror.can_serve(p.filter, p.sorts, p.start_cursor):
+            raise HTTPException(
+                status_code=409,
+                detail="start_cursor was issued by the local mirror, which can no longer serve this query; "
+                "repeat the query without start_cursor",
+            )
+        return True
+    if p.source == "notion":
+        return False
+    if mirror is not None and mirror.can_serve(p.filter, p.sorts, p.start_cursor):
+        return True
+    if p.source == "mirror":
+        raise HTTPException(status_code=409, detail="local mirror cannot serve this query")
+    return False
+
+
+def _query_rows(p: QueryDatabaseParams):
+    if _use_mirror(p):
+        return mirror.iter_rows(p.filter, p.sorts, p.limit, p.start_cursor)
+    return iter_database(p.filter, p.sorts, p.page_size, p.limit, p.start_cursor)
+
+
+@action("query_database", QueryDatabaseParams, stream=_query_rows)
+async def query_database_action(p: QueryDatabaseParams):
+    """Запросить записи базы NOTION_DATABASE_ID с фильтром, сортировкой и пагинацией."""
+    if _use_mirror(p):
+        return mirror.query(p.filter, p.sorts, p.page_size, p.start_cursor, fetch_all=p.all, limit=p.limit)
+    return await query_database(
+        p.filter, p.sorts, p.page_size, p.start_cursor, fetch_all=p.all, limit=p.limit
+    )
+
+
+@action("retrieve_page", PageParams)
+async def retrieve_page_action(p: PageParams):
+    """Получить страницу по ID."""
+    return await retrieve_page(p.page_id)
+
+
+@action("archive_page", ArchivePageParams)
+async def archive_page_action(p: ArchivePageParams):
+    """Архивировать (archived=true) или восстановить (archived=false) страницу."""
+    return await archive_page(p.page_id, p.archived)
+
+
+@action("delete_block", BlockParams)
+async def delete_block_action(p: BlockParams):
+    """Удалить (архивировать) блок."""
+    return await delete_block(p.block_id)
+
+
+@action("append_block_children", AppendBlockChildrenParams)
+async def append_block_children_action(p: AppendBlockChildrenParams):
+    """Добавить дочерние блоки; длинные списки делятся на части автоматически."""
+    return await append_block_children(p.block_id, p.children, p.idempotency_key, p.after)
+
+
+def _block_children_rows(p: BlockChildrenParams):
+    return iter_block_children(p.block_id, p.page_size, p.limit, p.start_cursor)
+
+
+@action("retrieve_block_children", BlockChildrenParams, stream=_block_children_rows)
+async def retrieve_block_children_action(p: BlockChildrenParams):
+    """Получить дочерние блоки блока или страницы."""
+    return await retrieve_block_children(
+        p.block_id, p.page_size, p.start_cursor, fetch_all=p.all, limit=p.limit
+    )
+
+
+@action("retrieve_block_tree", BlockTreeParams)
+async def retrieve_block_tree_action(p: BlockTreeParams):
+    """Рекурсивно получить все вложенные блоки деревом или плоским списком."""
+    return await retrieve_block_tree(
+        p.block_id,
+        max_depth=p.max_depth,
+        concurrency=p.concurrency,
+        flat=p.format == "flat",
+        include_child_pages=p.include_child_pages,
+    )
+
+
+@action("retrieve_database", RetrieveDatabaseParams)
+async def retrieve_database_action(p: RetrieveDatabaseParams):
+    """Получить схему базы данных (из кэша, если она свежая)."""
+    return await retrieve_database(p.database_id, p.refresh)
+
+
+@action("refresh_database_schema", RefreshSchemaParams)
+async def refresh_database_schema_action(p: RefreshSchemaParams):
+    """Перечитать схему базы данных из Notion, минуя кэш."""
+    database_id = p.database_id or os.getenv("NOTION_DATABASE_ID")
+    if not database_id:
+        raise HTTPException(status_code=400, detail="database_id is required for refresh_database_schema")
+    return await retrieve_database(database_id, refresh=True)
+
+
+def _search_rows(p: SearchParams):
+    return iter_search(p.query, p.filter, p.sort, p.page_size, p.limit, p.start_cursor)
+
+
+@action("search", SearchParams, stream=_search_rows)
+async def search_action(p: SearchParams):
+    """Поиск по рабочему пространству Notion."""
+    return await search(
+        p.query, p.filter, p.sort, p.page_size, p.start_cursor, fetch_all=p.all, limit=p.limit
+    )
+
+
+@action("local_search", LocalSearchParams)
+async def local_search_action(p: LocalSearchParams):
+    """Мгновенный поиск по заголовкам, свойствам и тексту блоков, которые сервер уже видел."""
+    if search_index is None:
+        raise HTTPException(status_code=409, detail="local search index is disabled")
+    return search_index.search(p.query, p.kind, p.limit)
+
+
+async def execute_step(name: str, parameters: Dict[str, Any]) -> Any:
+    """Выполнить один шаг конвейера и вернуть его ``data``."""
+    if name == "pipeline":
+        raise HTTPException(status_code=400, detail="nested pipelines are not supported")
+    found, params = resolve(name, parameters)
+    if getattr(params, "stream", False):
+        raise HTTPException(status_code=400, detail="stream is not supported in pipeline")
+    return await found.handler(params)
+
+
+@action("pipeline", PipelineParams)
+async def pipeline_action(p: PipelineParams):
+    """Выполнить несколько действий с зависимостями ($steps[N].path) за один вызов."""
+    try:
+        return await run_pipeline(p.steps, execute_step, BATCH_CONCURRENCY)
+    except PipelineError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк: HTTP/1.1 против HTTP/2 на пачках параллельных ``retrieve_page``.
+
+Поднимает локальный mock Notion API (hypercorn, h2c с заранее
+известной поддержкой HTTP/2), затем для каждого транспорта выполняет
+несколько «пачек» одновременных ``retrieve_page`` через общий клиент
+``notion_client`` и печатает задержки, пропускную способность и
+число TCP-соединений, открытых на стороне сервера.
+
+Зависимости бенчмарка (не нужны серверу): ``pip install hypercorn h2``.
+
+Запуск::
+
+    python benchmarks/http2_burst.py --bursts 20 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import notion_client  # noqa: E402
+
+PAGE = {"object": "page", "id": "00000000-0000-0000-0000-000000000000", "properties": {}}
+
+
+class MockNotion:
+    """Минимальное ASGI-приложение, отвечающее на GET /v1/pages/{id}."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.connections: set = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        self.connections.add(tuple(scope.get("client") or ()))
+        await asyncio.sleep(self.latency)
+        body = json.dumps(PAGE).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+async def run_mode(mode: str, bursts: int, concurrency: int, app: MockNotion) -> dict:
+    notion_client.HTTP2 = mode
+    await notion_client.close_client()
+    await notion_client.init_client()
+    app.connections.clear()
+    # измеряется транспорт: без лимита частоты и без ответов из кэшей
+    notion_client.scheduler = notion_client.RateLimiter(rate=1_000_000, burst=1_000_000)
+    notion_client.disk_cache = None
+    for cache in (notion_client.page_cache, notion_client.negative_cache):
+        cache.clear()
+    prefix = mode or "http1"
+
+    latencies = []
+
+    async def one(i: int) -> None:
+        started = time.perf_counter()
+        await notion_client.retrieve_page(f"{prefix}-page-{i}")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for b in range(bursts):
+        await asyncio.gather(*(one(b * concurrency + i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await notion_client.close_client()
+
+    latencies.sort()
+    return {
+        "mode": "http2" if mode else "http1.1",
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "connections": len(app.connections),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка mock-сервера, с")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{args.port}"]
+    config.loglevel = "WARNING"
+    app = MockNotion(args.latency)
+    shutdown = asyncio.Event()
+    server = asyncio.create_task(serve(app, config, shutdown_trigger=shutdown.wait))
+    await asyncio.sleep(0.5)
+
+    notion_client.BASE = f"http://127.0.0.1:{args.port}/v1"
+    try:
+        for mode in ("", "h2c"):
+            print(json.dumps(await run_mode(mode, args.bursts, args.concurrency, app)))
+    finally:
+        shutdown.set()
+        await server
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
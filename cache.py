@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Внутрипроцессные кэши для ответов Notion API."""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable
+
+
+class TTLCache:
+    """LRU-кэш ограниченного размера с временем жизни записей.
+
+    Чтение с промахом, которое завершилось после записи того же ключа,
+    не должно перезаписать свежие данные устаревшими. Для этого перед
+    запросом берётся ``generation(key)``, а результат сохраняется через
+    ``set(key, value, generation=...)`` — если ключ успели изменить или
+    инвалидировать (в том числе через ``clear()``), значение отбрасывается.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._marks: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._counter = 0
+        # значение счётчика при последнем clear(): старше него поколений нет
+        self._cleared = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and self._clock() - entry[0] < self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def get_entry(self, key: Hashable) -> tuple[Any, float] | None:
+        """Значение и его возраст в секундах или ``None``."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        age = self._clock() - stored_at
+        if age >= self.ttl:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value, age
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Вернуть значение без учёта в статистике и без продления LRU."""
+        entry = self._data.get(key)
+        if entry is None or self._clock() - entry[0] >= self.ttl:
+            return default
+        return entry[1]
+
+    def generation(self, key: Hashable) -> int:
+        return max(self._marks.get(key, 0), self._cleared)
+
+    def set(self, key: Hashable, value: Any, generation: int | None = None, age: float = 0.0) -> bool:
+        """Сохранить значение; ``age`` — сколько секунд назад оно было получено."""
+        if generation is not None and generation != self.generation(key):
+            return False
+        self._data[key] = (self._clock() - age, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, key: Hashable) -> None:
+        """Удалить запись и отменить незавершённые чтения этого ключа."""
+        self._counter += 1
+        self._marks[key] = self._counter
+        self._marks.move_to_end(key)
+        while len(self._marks) > self.maxsize:
+            self._marks.popitem(last=False)
+        self._data.pop(key, None)
+
+    def replace(self, key: Hashable, value: Any) -> None:
+        """Записать свежее значение после изменения объекта (write-through)."""
+        self.invalidate(key)
+        self.set(key, value)
+
+    def clear(self) -> None:
+        """Удалить все записи и отменить все незавершённые чтения, даже ещё не сохранённых ключей."""
+        self._counter += 1
+        self._cleared = self._counter
+        self._data.clear()
+        self._marks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+@dataclass(frozen=True)
+class Freshness:
+    """Политика свежести кэшированного ответа (возраст в секундах).
+
+    Моложе ``fresh`` — ответ отдаётся из кэша как есть. Моложе
+    ``stale`` — отдаётся сразу, а в фоне перечитывается из Notion.
+    Моложе ``max_stale`` — перечитывается сразу, но если Notion
+    недоступен, отдаётся устаревший ответ. Старше — удаляется из кэша.
+    """
+
+    fresh: float
+    stale: float
+    max_stale: float
+
+    @classmethod
+    def of(cls, fresh: float, stale: float, max_stale: float) -> "Freshness":
+        """Политика с упорядоченными границами ``fresh <= stale <= max_stale``."""
+        stale = max(stale, fresh)
+        return cls(fresh, stale, max(max_stale, stale))
+
+    def state(self, age: float) -> str:
+        if age < self.fresh:
+            return "fresh"
+        if age < self.stale:
+            return "stale"
+        return "expired"
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Кэш ответов Notion на диске (SQLite), переживающий перезапуск процесса.
+
+Записи хранятся по виду (``page``, ``database``, ``block_children``,
+``content``) и ID объекта вместе с его ``last_edited_time`` и временем
+сохранения.
+Время — по настенным часам, чтобы возраст записи был верен и после
+перезапуска. Размер ограничен: при превышении удаляются записи, к
+которым дольше всего не обращались.
+"""
+
+import json
+import time
+import sqlite3
+import logging
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    last_edited_time TEXT,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries(used_at);
+"""
+
+# После вытеснения остаётся не больше этой доли лимита, чтобы не
+# вытеснять при каждой записи.
+_EVICT_TO = 0.9
+
+
+class DiskCache:
+    """Ограниченный по размеру кэш JSON-ответов в SQLite."""
+
+    def __init__(self, path: str, max_bytes: int, clock: Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_SCHEMA)
+        (size,) = self.db.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(
+        self, kind: str, key: str, max_age: float, last_edited_time: Optional[str] = None
+    ) -> Optional[Tuple[Any, float]]:
+        """Значение и его возраст, если запись моложе ``max_age`` секунд.
+
+        С ``last_edited_time`` запись подходит, только если сохранена для
+        той же версии объекта (тогда возраст не важен — передайте
+        ``float("inf")``).
+        """
+        row = self.db.execute(
+            "SELECT last_edited_time, stored_at, data FROM entries WHERE kind = ? AND id = ?", (kind, key)
+        ).fetchone()
+        now = self._clock()
+        if row is None or now - row[1] >= max_age or (
+            last_edited_time is not None and row[0] != last_edited_time
+        ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.db:
+            self.db.execute("UPDATE entries SET used_at = ? WHERE kind = ? AND id = ?", (now, kind, key))
+        return json.loads(row[2]), now - row[1]
+
+    def set(self, kind: str, key: str, value: Any, last_edited_time: Optional[str] = None) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        now = self._clock()
+        with self.db:
+            old = self.db.execute("SELECT size FROM entries WHERE kind = ? AND id = ?", (kind, key)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (kind, id, last_edited_time, stored_at, used_at, size, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, key, last_edited_time, now, now, len(data), data),
+            )
+            self.size += len(data) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        target = self.max_bytes * _EVICT_TO
+        victims = []
+        for kind, key, size in self.db.execute("SELECT kind, id, size FROM entries ORDER BY used_at"):
+            if self.size <= target:
+                break
+            victims.append((kind, key))
+            self.size -= size
+        self.db.executemany("DELETE FROM entries WHERE kind = ? AND id = ?", victims)
+        self.evictions += len(victims)
+
+    def invalidate(self, kind: str, key: str) -> None:
+        with self.db:
+            old = self.db.execute("SELECT size FROM entries WHERE kind = ? AND id = ?", (kind, key)).fetchone()
+            if old is not None:
+                self.db.execute("DELETE FROM entries WHERE kind = ? AND id = ?", (kind, key))
+                self.size -= old[0]
+
+    def recent(self, kind: str, max_age: float) -> Iterator[Tuple[str, Any, float]]:
+        """Записи вида ``kind`` моложе ``max_age``: ``(id, значение, возраст)``."""
+        now = self._clock()
+        rows = self.db.execute(
+            "SELECT id, stored_at, data FROM entries WHERE kind = ? AND stored_at > ? ORDER BY used_at",
+            (kind, now - max_age),
+        ).fetchall()
+        for key, stored_at, data in rows:
+            yield key, json.loads(data), now - stored_at
+
+    def close(self) -> None:
+        self.db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        counts = dict(self.db.execute("SELECT kind, count(*) FROM entries GROUP BY kind"))
+        return {
+            "entries": counts,
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""Перевод фильтров и сортировок Notion в SQL над локальной копией базы.
+
+Значения свойств страниц хранятся в таблице ``props`` по строке на
+значение (у ``multi_select`` их несколько, пустые значения не
+хранятся): ``text`` — текст, имя варианта или дата как есть,
+``fold`` — текст в нижнем регистре для поиска без учёта регистра,
+``num`` — число, флажок (0/1) или дата в секундах UTC. Условия
+компилируются в ``pages.id IN (SELECT page_id FROM props ...)``, что
+использует индексы по ``(name, text)`` и ``(name, num)``.
+
+Поддерживаются составные ``and``/``or``, условия по свойствам title,
+rich_text, number, date, select, multi_select, checkbox, status и
+фильтры по ``created_time``/``last_edited_time``. Всё остальное
+(formula, rollup, относительные даты вроде ``past_week`` и т.п.), а
+также условие по неизвестному свойству или не того типа, даёт
+:class:`UnsupportedFilter` — такой запрос нужно отправить в Notion, и
+он вернёт настоящую ошибку проверки.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROPS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS props (
+    page_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    text TEXT,
+    fold TEXT,
+    num REAL
+);
+CREATE INDEX IF NOT EXISTS props_page ON props(page_id);
+CREATE INDEX IF NOT EXISTS props_text ON props(name, text);
+CREATE INDEX IF NOT EXISTS props_fold ON props(name, fold);
+CREATE INDEX IF NOT EXISTS props_num ON props(name, num);
+"""
+
+TEXT_TYPES = {"title", "rich_text"}
+# По вариантам select/status Notion сортирует в порядке схемы, а не по имени.
+SORTABLE_TYPES = TEXT_TYPES | {"number", "date", "checkbox"}
+TIMESTAMPS = {"created_time", "last_edited_time"}
+
+SQL = Tuple[str, List[Any]]
+
+
+class UnsupportedFilter(ValueError):
+    """Фильтр или сортировку нельзя выполнить локально без потери точности."""
+
+
+def _epoch(value: str) -> float:
+    """Дата или дата-время ISO 8601 в секундах UTC (дата без времени — полночь UTC)."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _plain_text(items: List[Dict[str, Any]]) -> str:
+    return "".join(i.get("plain_text") or i.get("text", {}).get("content", "") for i in items or [])
+
+
+def property_rows(properties: Dict[str, Any]) -> Iterator[Tuple[str, str, Optional[str], Optional[str], Optional[float]]]:
+    """Строки ``(name, type, text, fold, num)`` таблицы ``props`` для свойств страницы."""
+    for name, prop in (properties or {}).items():
+        kind = prop.get("type")
+        value = prop.get(kind)
+        if kind in TEXT_TYPES:
+            text = _plain_text(value)
+            if text:
+                yield name, kind, text, text.casefold(), None
+        elif kind == "number":
+            if value is not None:
+                yield name, kind, None, None, float(value)
+        elif kind == "checkbox":
+            yield name, kind, None, None, 1.0 if value else 0.0
+        elif kind in ("select", "status"):
+            if value:
+                yield name, kind, value["name"], value["name"].casefold(), None
+        elif kind == "multi_select":
+            for option in value or []:
+                yield name, kind, option["name"], option["name"].casefold(), None
+        elif kind == "date":
+            if value and value.get("start"):
+                yield name, kind, value["start"], None, _epoch(value["start"])
+
+
+def _has(name: str, condition: str, params: List[Any]) -> SQL:
+    return (
+        f"pages.id IN (SELECT page_id FROM props WHERE name = ? AND {condition})",
+        [name, *params],
+    )
+
+
+def _has_not(name: str, condition: str, params: List[Any]) -> SQL:
+    sql, args = _has(name, condition, params)
+    return f"NOT {sql}", args
+
+
+def _empty(name: str, operator: str) -> SQL:
+    # пустые значения в props не хранятся
+    if operator == "is_empty":
+        return _has_not(name, "1", [])
+    return _has(name, "1", [])
+
+
+def _text_condition(name: str, operator: str, value: Any) -> SQL:
+    if operator in ("is_empty", "is_not_empty"):
+        return _empty(name, operator)
+    if not isinstance(value, str) or not value:
+        raise UnsupportedFilter(f"{name}: {operator} expects a non-empty string")
+    folded = value.casefold()
+    if operator == "equals":
+        return _has(name, "text = ?", [value])
+    if operator == "does_not_equal":
+        return _has_not(name, "text = ?", [value])
+    if operator == "contains":
+        return _has(name, "instr(fold, ?) > 0", [folded])
+    if operator == "does_not_contain":
+        return _has_not(name, "instr(fold, ?) > 0", [folded])
+    if operator == "starts_with":
+        return _has(name, "substr(fold, 1, ?) = ?", [len(folded), folded])
+    if operator == "ends_with":
+        return _has(name, "substr(fold, -?) = ?", [len(folded), folded])
+    raise UnsupportedFilter(f"{name}: unsupported text condition {operator!r}")
+
+
+_NUMBER_OPERATORS = {
+    "equals": "=",
+    "does_not_equal": "!=",
+    "greater_than": ">",
+    "less_than": "<",
+    "greater_than_or_equal_to": ">=",
+    "less_than_or_equal_to": "<=",
+}
+
+
+def _number_condition(name: str, operator: str, value: Any) -> SQL:
+    if operator in ("is_empty", "is_not_empty"):
+        return _empty(name, operator)
+    if operator not in _NUMBER_OPERATORS or isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise UnsupportedFilter(f"{name}: unsupported number condition {operator!r}")
+    if operator == "does_not_equal":
+        return _has_not(name, "num = ?", [float(value)])
+    return _has(name, f"num {_NUMBER_OPERATORS[operator]} ?", [float(value)])
+
+
+def _checkbox_condition(name: str, operator: str, value: Any) -> SQL:
+    if operator not in ("equals", "does_not_equal") or not isinstance(value, bool):
+        raise UnsupportedFilter(f"{name}: unsupported checkbox condition {operator!r}")
+    expected = value if operator == "equals" else not value
+    return _has(name, "num = ?", [1.0 if expected else 0.0])
+
+
+def _option_condition(name: str, operator: str, value: Any) -> SQL:
+    if operator in ("is_empty", "is_not_empty"):
+        return _empty(name, operator)
+    if not isinstance(value, str):
+        raise UnsupportedFilter(f"{name}: {operator} expects an option name")
+    if operator in ("equals", "contains"):
+        return _has(name, "text = ?", [value])
+    if operator in ("does_not_equal", "does_not_contain"):
+        return _has_not(name, "text = ?", [value])
+    raise UnsupportedFilter(f"{name}: unsupported option condition {operator!r}")
+
+
+_DATE_OPERATORS = {
+    "equals": "=",
+    "before": "<",
+    "after": ">",
+    "on_or_before": "<=",
+    "on_or_after": ">=",
+}
+
+
+def _date_operand(operator: str, value: Any) -> Tuple[str, Any]:
+    """Сравнивать по дню, если в условии дата без времени, иначе по моменту."""
+    if operator not in _DATE_OPERATORS or not isinstance(value, str):
+        raise UnsupportedFilter(f"unsupported date condition {operator!r}")
+    try:
+        moment = _epoch(value)
+    except ValueError:
+        raise UnsupportedFilter(f"invalid date {value!r}") from None
+    if len(value) == 10:
+        return "day", value
+    return "moment", moment
+
+
+def _date_condition(name: str, operator: str, value: Any) -> SQL:
+    if operator in ("is_empty", "is_not_empty"):
+        return _empty(name, operator)
+    kind, operand = _date_operand(operator, value)
+    column = "substr(text, 1, 10)" if kind == "day" else "num"
+    return _has(name, f"{column} {_DATE_OPERATORS[operator]} ?", [operand])
+
+
+def _timestamp_condition(column: str, operator: str, value: Any) -> SQL:
+    if operator in ("is_empty", "is_not_empty"):
+        return ("0" if operator == "is_empty" else "1"), []
+    kind, operand = _date_operand(operator, value)
+    if kind == "day":
+        return f"substr(pages.{column}, 1, 10) {_DATE_OPERATORS[operator]} ?", [operand]
+    # Notion отдаёт время в UTC с миллисекундами, строки сравнимы напрямую
+    moment = datetime.fromtimestamp(operand, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + "000Z"
+    return f"pages.{column} {_DATE_OPERATORS[operator]} ?", [moment]
+
+
+_PROPERTY_CONDITIONS = {
+    "title": _text_condition,
+    "rich_text": _text_condition,
+    "number": _number_condition,
+    "checkbox": _checkbox_condition,
+    "select": _option_condition,
+    "status": _option_condition,
+    "multi_select": _option_condition,
+    "date": _date_condition,
+}
+
+
+def _single(condition: Any) -> Tuple[str, Any]:
+    if not isinstance(condition, dict) or len(condition) != 1:
+        raise UnsupportedFilter(f"expected exactly one condition in {condition!r}")
+    ((operator, value),) = condition.items()
+    return operator, value
+
+
+def _check_type(name: str, kind: str, types: Dict[str, str]) -> None:
+    actual = types.get(name)
+    # условие rich_text Notion принимает и для свойства title
+    if kind != actual and not (kind == "rich_text" and actual == "title"):
+        raise UnsupportedFilter(f"{name}: {kind} condition on {actual or 'unknown'} property")
+
+
+def compile_filter(filter_payload: Optional[Dict[str, Any]], types: Dict[str, str]) -> SQL:
+    """Условие ``WHERE`` для фильтра ``query_database``; ``types`` — типы свойств по имени."""
+    if not filter_payload:
+        return "1", []
+    if not isinstance(filter_payload, dict):
+        raise UnsupportedFilter("filter must be an object")
+    for compound, joiner in (("and", " AND "), ("or", " OR ")):
+        if compound in filter_payload:
+            parts = [compile_filter(f, types) for f in filter_payload[compound]]
+            if not parts:
+                return ("1" if compound == "and" else "0"), []
+            return "(" + joiner.join(sql for sql, _ in parts) + ")", [a for _, args in parts for a in args]
+    if "timestamp" in filter_payload:
+        column = filter_payload["timestamp"]
+        if column not in TIMESTAMPS:
+            raise UnsupportedFilter(f"unsupported timestamp {column!r}")
+        operator, value = _single(filter_payload.get(column))
+        return _timestamp_condition(column, operator, value)
+    name = filter_payload.get("property")
+    kinds = [k for k in filter_payload if k != "property"]
+    if not isinstance(name, str) or len(kinds) != 1 or kinds[0] not in _PROPERTY_CONDITIONS:
+        raise UnsupportedFilter(f"unsupported filter {filter_payload!r}")
+    _check_type(name, kinds[0], types)
+    operator, value = _single(filter_payload[kinds[0]])
+    return _PROPERTY_CONDITIONS[kinds[0]](name, operator, value)
+
+
+def compile_sorts(sorts: Optional[List[Dict[str, Any]]], types: Dict[str, str]) -> SQL:
+    """Выражение ``ORDER BY``; ``types`` — типы свойств по имени.
+
+    Без сортировки записи идут от новых к старым по ``created_time``.
+    Пустые значения свойств, как и в Notion, всегда в конце.
+    """
+    order: List[str] = []
+    params: List[Any] = []
+    for s in sorts or []:
+        direction = "ASC" if s.get("direction") == "ascending" else "DESC"
+        if "timestamp" in s and "property" not in s:
+            if s["timestamp"] not in TIMESTAMPS:
+                raise UnsupportedFilter(f"unsupported sort timestamp {s['timestamp']!r}")
+            order.append(f"pages.{s['timestamp']} {direction}")
+            continue
+        name = s.get("property")
+        kind = types.get(name)
+        if kind not in SORTABLE_TYPES:
+            raise UnsupportedFilter(f"cannot sort by property {name!r} locally")
+        column = "fold" if kind in TEXT_TYPES else "num"
+        key = f"(SELECT min({column}) FROM props WHERE page_id = pages.id AND name = ?)"
+        order.append(f"{key} IS NULL, {key} {direction}")
+        params += [name, name]
+    order = order or ["pages.created_time DESC"]
+    return ", ".join(order + ["pages.id"]), params
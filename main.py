@@ -3,10 +3,13 @@
 Notion MCP Server.
 
 Этот сервер предоставляет интерфейс JSON‑RPC для взаимодействия с
-Notion через ChatGPT. Он реализует keep‑alive SSE‑канал и эндпоинт
-``/mcp`` для выполнения различных действий: создание/изменение/архивация
-страниц, создание задач, чтение базы данных, поиск, добавление и
-удаление блоков и другие.
+Notion через ChatGPT. Эндпоинт ``/mcp`` принимает сообщения MCP
+(JSON‑RPC 2.0: ``initialize``, ``tools/list``, ``tools/call``) и
+команды вида ``{action, parameters}`` для выполнения различных
+действий: создание/изменение/архивация страниц, создание задач, чтение
+базы данных, поиск, добавление и удаление блоков и другие. SSE‑канал
+``/sse`` (или ``GET /mcp``) привязан к сессии и доставляет сообщения
+от сервера к клиенту.
 
 Аутентификация: если переменная окружения ``MCP_TOKEN`` задана,
 сервер ожидает Bearer‑токен в заголовке ``Authorization``; если
@@ -14,32 +17,64 @@ Notion через ChatGPT. Он реализует keep‑alive SSE‑канал
 """
 
 import os
+import json
 import asyncio
-from typing import Any, Dict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from sse_starlette.sse import EventSourceResponse
 from dotenv import load_dotenv
 
+from actions import BATCH_CONCURRENCY, list_tools, resolve
+from mcp_protocol import PARSE_ERROR, handle_payload, is_jsonrpc, sessions
+from mirror import mirror
+from search_index import search_index
+from warmup import warmup
 from notion_client import (
-    create_page,
-    create_task,
-    update_page,
-    query_database,
-    retrieve_page,
-    archive_page,
-    delete_block,
-    append_block_children,
-    retrieve_block_children,
-    retrieve_database,
-    search,
+    init_client,
+    close_client,
+    restore_caches,
+    disk_cache,
+    scheduler,
+    retry_stats,
+    singleflight,
+    page_cache,
+    schema_cache,
+    query_cache,
+    negative_cache,
+    content_cache,
+    content_checks,
+    revalidator,
+    NotionError,
 )
 
 load_dotenv()
 
-app = FastAPI(title="Notion MCP", version="0.2.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Один HTTP-клиент Notion, прогрев кэшей и фоновая синхронизация на всё время жизни процесса."""
+    await init_client()
+    restore_caches()
+    if mirror is not None:
+        mirror.start()
+    warmup.start()
+    try:
+        yield
+    finally:
+        await warmup.stop()
+        if mirror is not None:
+            await mirror.stop()
+        await revalidator.close()
+        await close_client()
+
+
+app = FastAPI(title="Notion MCP", version="0.2.0", lifespan=lifespan)
 
 # ---------- безопасность ----------
 bearer_scheme = HTTPBearer(auto_error=False)
@@ -70,82 +105,237 @@ class MCPCommand(BaseModel):
 
 
 # ---------- SSE ----------
-@app.get("/sse")
-async def sse(req):
+SSE_PING_INTERVAL = 15
+
+
+def _session_id(request: Request) -> str | None:
+    return request.headers.get("mcp-session-id") or request.query_params.get("session_id")
+
+
+@app.get("/sse", dependencies=[Depends(verify_token)])
+@app.get("/mcp", dependencies=[Depends(verify_token)])
+async def sse(request: Request):
+    """SSE-канал сессии для сообщений от сервера к клиенту.
+
+    С заголовком ``Mcp-Session-Id`` (или ``?session_id=``) поток
+    привязывается к существующей сессии. Без него создаётся новая
+    сессия и первым событием ``endpoint`` сообщается адрес для
+    POST-запросов; ответы на них тогда приходят в этот поток.
+    """
+    sid = _session_id(request)
+    session = sessions.get(sid)
+    if sid and session is None:
+        raise HTTPException(status_code=404, detail="unknown session")
+    created = session is None
+    if created:
+        session = sessions.create()
+
     async def stream():
-        while not await req.is_disconnected():
-            yield {"event": "message", "data": "ready"}
-            await asyncio.sleep(60)
+        session.streams += 1
+        try:
+            if created:
+                yield {"event": "endpoint", "data": f"/mcp?session_id={session.id}"}
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(session.queue.get(), SSE_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    continue
+                yield {"event": "message", "data": json.dumps(message, ensure_ascii=False)}
+        finally:
+            session.streams -= 1
+            session.touch()
+            if not session.streams:
+                # клиент отключился: незачем тратить лимит Notion на его вызовы
+                session.cancel_all()
+
+    return EventSourceResponse(stream(), ping=SSE_PING_INTERVAL, headers={"Mcp-Session-Id": session.id})
+
+
+# ---------- метрики ----------
+@app.get("/ready")
+async def ready():
+    """Проверка готовности: 503, пока не закончился прогрев кэшей."""
+    body = {"ready": warmup.ready, "warmup": warmup.stats()}
+    return JSONResponse(body, status_code=200 if warmup.ready else 503)
+
+
+@app.get("/stats", dependencies=[Depends(verify_token)])
+async def stats():
+    return {
+        "scheduler": scheduler.stats(),
+        "retries": retry_stats.stats(),
+        "singleflight": singleflight.stats(),
+        "page_cache": page_cache.stats(),
+        "schema_cache": schema_cache.stats(),
+        "query_cache": query_cache.stats(),
+        "negative_cache": negative_cache.stats(),
+        "content_cache": {**content_cache.stats(), **content_checks},
+        "revalidation": revalidator.stats(),
+        "disk_cache": disk_cache.stats() if disk_cache is not None else None,
+        "sessions": len(sessions),
+        "warmup": warmup.stats(),
+        "mirror": mirror.stats() if mirror is not None else None,
+        "search_index": search_index.stats() if search_index is not None else None,
+    }
+
+
+# ---------- потоковые ответы ----------
+async def ndjson_stream(items):
+    """Отдавать элементы по одному JSON-объекту на строку.
+
+    Ошибка Notion посреди обхода передаётся последней строкой вида
+    ``{"error": ...}``, так как статус ответа уже отправлен.
+    """
+    try:
+        async for item in items:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    except NotionError as exc:
+        yield json.dumps({"error": exc.response}, ensure_ascii=False) + "\n"
+
+
+async def sse_events(items):
+    """Отдавать элементы событиями SSE ``item``; в конце — ``done`` или ``error``."""
+    count = 0
+    try:
+        async for item in items:
+            count += 1
+            yield {"event": "item", "data": json.dumps(item, ensure_ascii=False)}
+    except NotionError as exc:
+        yield {"event": "error", "data": json.dumps(exc.response, ensure_ascii=False)}
+        return
+    yield {"event": "done", "data": json.dumps({"count": count})}
 
-    return EventSourceResponse(stream())
+
+def stream_response(items, mode):
+    """Потоковый ответ: ``"sse"`` — события SSE, иначе NDJSON."""
+    if mode == "sse":
+        return EventSourceResponse(sse_events(items))
+    return StreamingResponse(ndjson_stream(items), media_type="application/x-ndjson")
 
 
 # ---------- MCP ----------
+@app.get("/tools", dependencies=[Depends(verify_token)])
+async def tools():
+    """Список действий с JSON-схемами параметров."""
+    return {"tools": list_tools()}
+
+
+# Как часто проверять, не отключился ли клиент, пока идёт работа с Notion.
+DISCONNECT_POLL_INTERVAL = float(os.getenv("MCP_DISCONNECT_POLL_INTERVAL", "0.5"))
+# Нестандартный статус nginx «клиент закрыл запрос»: ответ всё равно
+# никто не прочитает, код нужен только для логов.
+CLIENT_CLOSED_REQUEST = 499
+
+
+async def cancel_on_disconnect(request: Request, work):
+    """Выполнить ``work``, отменив его, если клиент отключится раньше.
+
+    Отмена кооперативная: запросы, ждущие в очереди планировщика,
+    покидают её, объединённые чтения отменяются, когда их больше никто
+    не ждёт, а пакеты и конвейеры отменяют свои шаги.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
+    finally:
+        task.cancel()
+
+
 @app.post("/mcp", dependencies=[Depends(verify_token)])
-async def mcp(cmd: MCPCommand):
-    action = cmd.action
-    p = cmd.parameters
-
-    if action == "create_page":
-        return {"status": "ok", "data": await create_page(p.get("title", "Untitled"))}
-
-    if action == "create_task":
-        return {"status": "ok", "data": await create_task(p)}
-
-    if action == "update_page":
-        return {"status": "ok", "data": await update_page(p)}
-
-    if action == "query_database":
-        # p может содержать необязательный фильтр
-        filter_payload = p.get("filter") if isinstance(p, dict) else None
-        return {"status": "ok", "data": await query_database(filter_payload)}
-
-    if action == "retrieve_page":
-        page_id = p.get("page_id") if isinstance(p, dict) else None
-        if not page_id:
-            raise HTTPException(status_code=400, detail="page_id is required for retrieve_page")
-        return {"status": "ok", "data": await retrieve_page(page_id)}
-
-    if action == "archive_page":
-        page_id = p.get("page_id") if isinstance(p, dict) else None
-        archived_flag = p.get("archived", True) if isinstance(p, dict) else True
-        if not page_id:
-            raise HTTPException(status_code=400, detail="page_id is required for archive_page")
-        return {"status": "ok", "data": await archive_page(page_id, bool(archived_flag))}
-
-    if action == "delete_block":
-        block_id = p.get("block_id") if isinstance(p, dict) else None
-        if not block_id:
-            raise HTTPException(status_code=400, detail="block_id is required for delete_block")
-        return {"status": "ok", "data": await delete_block(block_id)}
-
-    if action == "append_block_children":
-        block_id = p.get("block_id") if isinstance(p, dict) else None
-        children = p.get("children") if isinstance(p, dict) else None
-        if not block_id or not isinstance(children, list):
-            raise HTTPException(status_code=400, detail="block_id and children (list) required for append_block_children")
-        return {"status": "ok", "data": await append_block_children(block_id, children)}
-
-    if action == "retrieve_block_children":
-        block_id = p.get("block_id") if isinstance(p, dict) else None
-        if not block_id:
-            raise HTTPException(status_code=400, detail="block_id is required for retrieve_block_children")
-        return {"status": "ok", "data": await retrieve_block_children(block_id)}
-
-    if action == "retrieve_database":
-        database_id = p.get("database_id") if isinstance(p, dict) else None
-        if not database_id:
-            raise HTTPException(status_code=400, detail="database_id is required for retrieve_database")
-        return {"status": "ok", "data": await retrieve_database(database_id)}
-
-    if action == "search":
-        query = p.get("query") if isinstance(p, dict) else None
-        if not query:
-            raise HTTPException(status_code=400, detail="query is required for search")
-        filter_payload = p.get("filter") if isinstance(p, dict) else None
-        sort_payload = p.get("sort") if isinstance(p, dict) else None
-        return {"status": "ok", "data": await search(query, filter_payload, sort_payload)}
-
-    # неизвестное действие
-    raise HTTPException(status_code=400, detail=f"unknown action: {action}")
-            
+async def mcp(request: Request):
+    """Выполнить одну команду или пакет команд.
+
+    Тело может быть сообщением JSON-RPC 2.0 (протокол MCP) или
+    командой ``{action, parameters}``. Пакет команд (массив)
+    выполняется параллельно; ответ — массив результатов в том же
+    порядке, у каждого свой ``status``.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse(
+            {"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": "parse error"}},
+            status_code=400,
+        )
+    if is_jsonrpc(body):
+        return await cancel_on_disconnect(request, mcp_jsonrpc(request, body))
+    if isinstance(body, list):
+        # каждый элемент пакета проверяется отдельно, ошибка — в его ответе
+        return await cancel_on_disconnect(request, run_batch(body))
+    try:
+        command = MCPCommand.model_validate(body)
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors())
+    # потоковые ответы Starlette сам прерывает при отключении клиента
+    return await cancel_on_disconnect(request, run_command(command))
+
+
+async def mcp_jsonrpc(request: Request, body: Any) -> Response:
+    sid = _session_id(request)
+    session = sessions.get(sid)
+    if sid and session is None:
+        raise HTTPException(status_code=404, detail="unknown session")
+    messages = body if isinstance(body, list) else [body]
+    if session is None and any(m.get("method") == "initialize" for m in messages):
+        session = sessions.create()
+
+    response = await handle_payload(body, session)
+    headers = {"Mcp-Session-Id": session.id} if session else {}
+    if response is None:
+        return Response(status_code=202, headers=headers)
+    if session is not None and session.streams and request.query_params.get("session_id"):
+        # транспорт HTTP+SSE: ответ уходит в SSE-поток сессии
+        session.send(response)
+        return Response(status_code=202, headers=headers)
+    return JSONResponse(response, headers=headers)
+
+
+@app.delete("/mcp", dependencies=[Depends(verify_token)])
+async def close_session(request: Request):
+    """Завершить MCP-сессию."""
+    sid = _session_id(request)
+    if not sid or not sessions.close(sid):
+        raise HTTPException(status_code=404, detail="unknown session")
+    return Response(status_code=204)
+
+
+async def run_batch(items: List[Any]) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_one(item: Any) -> Dict[str, Any]:
+        try:
+            cmd = MCPCommand.model_validate(item)
+        except ValidationError as exc:
+            detail = [f"{'.'.join(map(str, e['loc'])) or 'command'}: {e['msg']}" for e in exc.errors()]
+            return {"status": "error", "code": 400, "detail": detail}
+        if cmd.parameters.get("stream"):
+            return {"status": "error", "code": 400, "detail": "stream is not supported in batch"}
+        async with semaphore:
+            try:
+                return await run_command(cmd)
+            except HTTPException as exc:
+                return {"status": "error", "code": exc.status_code, "detail": exc.detail}
+            except NotionError as exc:
+                return {"status": "error", "code": 502, "detail": exc.response}
+            except Exception as exc:  # ошибка одной команды не должна ронять пакет
+                return {"status": "error", "code": 500, "detail": repr(exc)}
+
+    return list(await asyncio.gather(*(run_one(item) for item in items)))
+
+
+async def run_command(cmd: MCPCommand):
+    found, params = resolve(cmd.action, cmd.parameters)
+    mode = getattr(params, "stream", False)
+    if mode and found.stream is not None:
+        return stream_response(found.stream(params), mode)
+    return {"status": "ok", "data": await found.handler(params)}
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Транспорт MCP поверх JSON-RPC 2.0.
+
+Поддерживаются методы ``initialize``, ``ping``, ``tools/list`` и
+``tools/call`` и уведомление ``notifications/initialized``. Сессия
+создаётся при ``initialize`` (ID возвращается в заголовке
+``Mcp-Session-Id``) или при открытии SSE-канала. Сообщения, которые
+сервер отправляет клиенту вне ответа на запрос (ответы для
+SSE-транспорта, уведомления ``notifications/progress``), складываются
+в очередь сессии и отдаются её SSE-потоком. Вызов ``tools/call``
+отменяется уведомлением ``notifications/cancelled``, закрытием сессии
+или отключением последнего SSE-потока сессии.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from actions import list_tools, resolve
+from notion_client import NotionError, progress_callback
+
+PROTOCOL_VERSION = "2025-03-26"
+SERVER_INFO = {"name": "notion-mcp", "version": "0.2.0"}
+SESSION_TTL = float(os.getenv("MCP_SESSION_TTL", "3600"))
+
+# коды ошибок JSON-RPC 2.0
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+REQUEST_CANCELLED = -32800
+
+
+class Session:
+    """Состояние одного MCP-клиента."""
+
+    def __init__(self) -> None:
+        self.id = uuid.uuid4().hex
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.streams = 0
+        self.initialized = False
+        self.last_seen = time.monotonic()
+        # выполняющиеся tools/call по ID запроса
+        self.tasks: Dict[Any, asyncio.Task] = {}
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """Поставить сообщение в очередь SSE-потока сессии."""
+        self.queue.put_nowait(message)
+
+    def cancel(self, request_id: Any) -> bool:
+        task = self.tasks.get(request_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def cancel_all(self) -> None:
+        """Отменить все выполняющиеся вызовы, например после отключения клиента."""
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+    def touch(self) -> None:
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._sessions: Dict[str, Session] = {}
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for sid in [s.id for s in self._sessions.values() if not s.streams and now - s.last_seen > self.ttl]:
+            del self._sessions[sid]
+
+    def create(self) -> Session:
+        self._expire()
+        session = Session()
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        session = self._sessions.get(session_id) if session_id else None
+        if session is not None:
+            session.touch()
+        return session
+
+    def close(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.cancel_all()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+sessions = SessionStore(SESSION_TTL)
+
+
+def is_jsonrpc(body: Any) -> bool:
+    if isinstance(body, list):
+        return bool(body) and all(isinstance(m, dict) and m.get("jsonrpc") == "2.0" for m in body)
+    return isinstance(body, dict) and body.get("jsonrpc") == "2.0"
+
+
+def _error(msg_id: Any, code: int, message: str, data: Any = None) -> Dict[str, Any]:
+    error: Dict[str, Any] = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return {"jsonrpc": "2.0", "id": msg_id, "error": error}
+
+
+def _result(msg_id: Any, result: Dict[str, Any]) -> Dict[str, Any]:
+    return {"jsonrpc": "2.0", "id": msg_id, "result": result}
+
+
+def _tool_result(data: Any, is_error: bool = False) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        "content": [{"type": "text", "text": json.dumps(data, ensure_ascii=False)}],
+        "isError": is_error,
+    }
+    if isinstance(data, dict):
+        result["structuredContent"] = data
+    return result
+
+
+def _progress_sender(session: Session, token: Any):
+    """Отправлять прогресс операции уведомлениями в SSE-поток сессии.
+
+    Пока у сессии нет открытого потока, уведомления отбрасываются: иначе
+    очередь росла бы без ограничений, а подключившийся позже поток
+    получил бы лавину устаревшего прогресса.
+    """
+    count = 0
+
+    def send(message: str, details: Dict[str, Any]) -> None:
+        nonlocal count
+        count = max(count + 1, details.get("done", 0))
+        if not session.streams:
+            return
+        notification: Dict[str, Any] = {"progressToken": token, "progress": count, "message": message}
+        if details.get("total") is not None:
+            notification["total"] = details["total"]
+        session.send({"jsonrpc": "2.0", "method": "notifications/progress", "params": notification})
+
+    return send
+
+
+async def _call_tool(msg_id: Any, params: Dict[str, Any], session: Optional[Session]) -> Dict[str, Any]:
+    name = params.get("name")
+    try:
+        found, arguments = resolve(name, params.get("arguments") or {})
+    except HTTPException as exc:
+        return _error(msg_id, INVALID_PARAMS, f"invalid tool call: {name}", exc.detail)
+
+    token = (params.get("_meta") or {}).get("progressToken")
+    reset = None
+    if session is not None and token is not None:
+        reset = progress_callback.set(_progress_sender(session, token))
+    try:
+        # задача создаётся с копией контекста, поэтому видит подписчика прогресса
+        task = asyncio.ensure_future(found.handler(arguments))
+    finally:
+        if reset is not None:
+            progress_callback.reset(reset)
+    if session is not None:
+        session.tasks[msg_id] = task
+    try:
+        data = await task
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+        return _error(msg_id, REQUEST_CANCELLED, "request cancelled")
+    except HTTPException as exc:
+        return _result(msg_id, _tool_result({"error": exc.detail}, is_error=True))
+    except NotionError as exc:
+        return _result(msg_id, _tool_result(exc.response, is_error=True))
+    finally:
+        if session is not None and session.tasks.get(msg_id) is task:
+            del session.tasks[msg_id]
+    is_error = isinstance(data, dict) and (data.get("object") == "error" or "error" in data)
+    return _result(msg_id, _tool_result(data, is_error))
+
+
+async def handle_message(message: Any, session: Optional[Session]) -> Optional[Dict[str, Any]]:
+    """Обработать одно сообщение JSON-RPC; для уведомлений ответа нет."""
+    if not isinstance(message, dict) or message.get("jsonrpc") != "2.0" or "method" not in message:
+        return _error(message.get("id") if isinstance(message, dict) else None, INVALID_REQUEST, "invalid request")
+    method = message["method"]
+    msg_id = message.get("id")
+    params = message.get("params") or {}
+    is_notification = "id" not in message
+
+    if is_notification:
+        if session is not None:
+            if method == "notifications/initialized":
+                session.initialized = True
+            elif method == "notifications/cancelled":
+                session.cancel(params.get("requestId"))
+        return None
+
+    if method == "initialize":
+        return _result(
+            msg_id,
+            {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": SERVER_INFO,
+            },
+        )
+    if method == "ping":
+        return _result(msg_id, {})
+    if method == "tools/list":
+        return _result(msg_id, {"tools": list_tools()})
+    if method == "tools/call":
+        try:
+            return await _call_tool(msg_id, params, session)
+        except Exception as exc:
+            return _error(msg_id, INTERNAL_ERROR, repr(exc))
+    return _error(msg_id, METHOD_NOT_FOUND, f"method not found: {method}")
+
+
+async def handle_payload(body: Any, session: Optional[Session]) -> Any:
+    """Обработать сообщение или пакет сообщений JSON-RPC.
+
+    Возвращает ответ, список ответов или ``None``, если во входных
+    данных были только уведомления.
+    """
+    if isinstance(body, list):
+        responses: List[Dict[str, Any]] = [
+            r for r in await asyncio.gather(*(handle_message(m, session) for m in body)) if r is not None
+        ]
+        return responses or None
+    return await handle_message(body, session)
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""Локальная копия базы данных Notion в SQLite.
+
+Фоновая синхронизация сначала загружает всю базу ``NOTION_DATABASE_ID``
+постраничными запросами, затем периодически дочитывает только
+изменённые записи (фильтр по ``last_edited_time``). Полная
+перезагрузка раз в ``NOTION_MIRROR_FULL_SYNC_INTERVAL`` секунд убирает
+записи, удалённые или архивированные в обход сервера. Изменения,
+сделанные через этот сервер, попадают в копию сразу.
+
+Пока копия достаточно свежая, ``query_database`` обслуживается из неё
+без обращения к Notion: фильтры и сортировки переводятся в SQL модулем
+:mod:`filter_sql`, а то, что перевести нельзя, уходит в Notion. Ответ
+содержит ``_meta`` с возрастом данных.
+Копия включается переменной ``NOTION_MIRROR_PATH``.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from filter_sql import PROPS_SCHEMA, UnsupportedFilter, compile_filter, compile_sorts, property_rows
+from notion_client import _norm_id, add_page_listener, add_version_source, iter_database
+
+logger = logging.getLogger(__name__)
+
+MIRROR_PATH = os.getenv("NOTION_MIRROR_PATH")
+SYNC_INTERVAL = float(os.getenv("NOTION_MIRROR_SYNC_INTERVAL", "60"))
+FULL_SYNC_INTERVAL = float(os.getenv("NOTION_MIRROR_FULL_SYNC_INTERVAL", "3600"))
+# Копия старше этого возраста не используется для ответов.
+MAX_STALENESS = float(os.getenv("NOTION_MIRROR_MAX_STALENESS", "300"))
+
+CURSOR_PREFIX = "mirror:"
+# last_edited_time в Notion округлён до минуты: граница инкрементальной
+# синхронизации отступает на минуту от начала предыдущей.
+SYNC_SLACK = 60.0
+# При смене формата таблиц копия перезагружается с нуля.
+SCHEMA_VERSION = "2"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id TEXT PRIMARY KEY,
+    created_time TEXT NOT NULL,
+    last_edited_time TEXT NOT NULL,
+    sync_gen INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_created ON pages(created_time);
+CREATE INDEX IF NOT EXISTS pages_edited ON pages(last_edited_time);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+""" + PROPS_SCHEMA
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def is_mirror_cursor(start_cursor: Optional[str]) -> bool:
+    """Курсор выдан копией, а не Notion (Notion такой не примет)."""
+    return bool(start_cursor) and start_cursor.startswith(CURSOR_PREFIX)
+
+
+def cursor_offset(start_cursor: Optional[str]) -> Optional[int]:
+    """Смещение из курсора ``mirror:<смещение>``; ``None`` — курсор испорчен."""
+    if not start_cursor:
+        return 0
+    digits = start_cursor[len(CURSOR_PREFIX):] if is_mirror_cursor(start_cursor) else ""
+    return int(digits) if digits.isdigit() else None
+
+
+class DatabaseMirror:
+    """SQLite-копия одной базы данных Notion."""
+
+    def __init__(self, path: str, database_id: str) -> None:
+        self.path = path
+        self.database_id = database_id
+        self.db: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._gen = 0
+        self.last_sync: Optional[float] = None
+        self.last_full_sync: Optional[float] = None
+        self.local_queries = 0
+        self.sync_errors = 0
+        add_page_listener(self.apply)
+        add_version_source(self.version)
+
+    # ---------- хранилище ----------
+    def open(self) -> None:
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_SCHEMA)
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        if meta and (meta.get("database_id"), meta.get("schema")) != (self.database_id, SCHEMA_VERSION):
+            # файл от другой базы или старого формата — начинаем с нуля
+            self.db.executescript("DELETE FROM pages; DELETE FROM props; DELETE FROM meta;")
+            meta = {}
+        self._set_meta("database_id", self.database_id)
+        self._set_meta("schema", SCHEMA_VERSION)
+        self._gen = int(meta.get("sync_gen", 0))
+        self.last_sync = float(meta["last_sync"]) if "last_sync" in meta else None
+        self.last_full_sync = float(meta["last_full_sync"]) if "last_full_sync" in meta else None
+        self.db.commit()
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _belongs(self, page: Dict[str, Any]) -> bool:
+        parent_id = page.get("parent", {}).get("database_id")
+        return bool(parent_id) and _norm_id(parent_id) == _norm_id(self.database_id)
+
+    def upsert(self, page: Dict[str, Any]) -> None:
+        if page.get("archived") or page.get("in_trash"):
+            self.remove(page["id"])
+            return
+        page_id = _norm_id(page["id"])
+        self.db.execute("DELETE FROM props WHERE page_id = ?", (page_id,))
+        self.db.executemany(
+            "INSERT INTO props (page_id, name, type, text, fold, num) VALUES (?, ?, ?, ?, ?, ?)",
+            [(page_id, *row) for row in property_rows(page.get("properties"))],
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages (id, created_time, last_edited_time, sync_gen, data) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                page_id,
+                page.get("created_time", ""),
+                page.get("last_edited_time", ""),
+                self._gen,
+                json.dumps(page, ensure_ascii=False),
+            ),
+        )
+
+    def remove(self, page_id: str) -> None:
+        self.db.execute("DELETE FROM pages WHERE id = ?", (_norm_id(page_id),))
+        self.db.execute("DELETE FROM props WHERE page_id = ?", (_norm_id(page_id),))
+
+    def apply(self, result: Dict[str, Any]) -> None:
+        """Учесть изменение, сделанное через этот сервер."""
+        if self.db is None or not result.get("id"):
+            return
+        if result.get("archived") or result.get("in_trash"):
+            self.remove(result["id"])
+        elif result.get("object") == "page" and self._belongs(result):
+            self.upsert(result)
+        else:
+            return
+        self.db.commit()
+
+    # ---------- синхронизация ----------
+    async def _load(self, filter_payload: Optional[Dict[str, Any]]) -> int:
+        count = 0
+        async for page in iter_database(filter_payload, database_id=self.database_id):
+            self.upsert(page)
+            count += 1
+            if count % 100 == 0:
+                self.db.commit()
+        self.db.commit()
+        return count
+
+    async def sync_full(self) -> int:
+        """Загрузить базу целиком и удалить записи, которых в ней больше нет."""
+        started = time.time()
+        self._gen += 1
+        count = await self._load(None)
+        self.db.execute(
+            "DELETE FROM props WHERE page_id IN (SELECT id FROM pages WHERE sync_gen < ?)", (self._gen,)
+        )
+        self.db.execute("DELETE FROM pages WHERE sync_gen < ?", (self._gen,))
+        self.last_sync = self.last_full_sync = started
+        self._set_meta("sync_gen", self._gen)
+        self._set_meta("last_sync", started)
+        self._set_meta("last_full_sync", started)
+        self.db.commit()
+        return count
+
+    async def sync_incremental(self) -> int:
+        """Дочитать записи, изменённые с момента последней синхронизации."""
+        started = time.time()
+        if self.last_sync is None:
+            return await self.sync_full()
+        # Граница — время начала прошлой синхронизации, а не максимум
+        # last_edited_time в таблице: записи через этот сервер попадают в
+        # копию сразу и сдвинули бы максимум мимо внешних правок.
+        watermark = _iso(self.last_sync - SYNC_SLACK)
+        count = await self._load(
+            {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": watermark}}
+        )
+        self.last_sync = started
+        self._set_meta("last_sync", started)
+        self.db.commit()
+        return count
+
+    async def sync(self) -> int:
+        if self.last_full_sync is None or time.time() - self.last_full_sync >= FULL_SYNC_INTERVAL:
+            return await self.sync_full()
+        return await self.sync_incremental()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.sync_errors += 1
+                logger.exception("mirror sync failed")
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    def start(self) -> None:
+        if self.db is None:
+            self.open()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.close()
+
+    # ---------- чтение ----------
+    @property
+    def age(self) -> Optional[float]:
+        return None if self.last_sync is None else time.time() - self.last_sync
+
+    @property
+    def fresh(self) -> bool:
+        return self.db is not None and self.age is not None and self.age <= MAX_STALENESS
+
+    def freshness(self) -> Dict[str, Any]:
+        return {
+            "source": "mirror",
+            "synced_at": _iso(self.last_sync) if self.last_sync else None,
+            "age": self.age,
+        }
+
+    def version(self, page_id: str) -> Optional[str]:
+        """``last_edited_time`` страницы по свежей копии или ``None``."""
+        if not self.fresh:
+            return None
+        row = self.db.execute("SELECT last_edited_time FROM pages WHERE id = ?", (_norm_id(page_id),)).fetchone()
+        return row[0] if row else None
+
+    def _types(self) -> Dict[str, str]:
+        """Типы свойств по последней изменённой записи.
+
+        В ``props`` нет пустых значений, а в самой записи Notion
+        перечисляет все свойства базы.
+        """
+        row = self.db.execute("SELECT data FROM pages ORDER BY last_edited_time DESC LIMIT 1").fetchone()
+        if row is None:
+            return {}
+        return {name: prop.get("type") for name, prop in json.loads(row[0]).get("properties", {}).items()}
+
+    def _compile(
+        self, filter_payload: Optional[Dict[str, Any]], sorts: Optional[List[Dict[str, Any]]]
+    ) -> Tuple[str, List[Any]]:
+        types = self._types()
+        where, where_args = compile_filter(filter_payload, types)
+        order, order_args = compile_sorts(sorts, types)
+        return f"SELECT data FROM pages WHERE {where} ORDER BY {order}", where_args + order_args
+
+    def can_serve(
+        self,
+        filter_payload: Optional[Dict[str, Any]],
+        sorts: Optional[List[Dict[str, Any]]],
+        start_cursor: Optional[str],
+    ) -> bool:
+        """Можно ли ответить на запрос из копии без потери точности."""
+        if not self.fresh:
+            return False
+        if cursor_offset(start_cursor) is None:
+            return False
+        try:
+            self._compile(filter_payload, sorts)
+        except UnsupportedFilter as exc:
+            logger.debug("mirror cannot serve query: %s", exc)
+            return False
+        return True
+
+    def _offset(self, start_cursor: Optional[str]) -> int:
+        offset = cursor_offset(start_cursor)
+        if offset is None:
+            raise ValueError(f"invalid mirror cursor {start_cursor!r}")
+        return offset
+
+    def _select(
+        self,
+        filter_payload: Optional[Dict[str, Any]],
+        sorts: Optional[List[Dict[str, Any]]],
+        offset: int,
+        limit: int,
+    ) -> Iterator[Dict[str, Any]]:
+        sql, args = self._compile(filter_payload, sorts)
+        for (data,) in self.db.execute(f"{sql} LIMIT ? OFFSET ?", (*args, limit, offset)):
+            yield json.loads(data)
+
+    def query(
+        self,
+        filter_payload: Optional[Dict[str, Any]] = None,
+        sorts: Optional[List[Dict[str, Any]]] = None,
+        page_size: Optional[int] = None,
+        start_cursor: Optional[str] = None,
+        fetch_all: bool = False,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Ответ в формате ``query_database`` из локальной копии.
+
+        Без сортировки записи идут от новых к старым по ``created_time``.
+        Курсоры имеют вид ``mirror:<смещение>``.
+        """
+        self.local_queries += 1
+        offset = self._offset(start_cursor)
+        if not fetch_all and limit is None:
+            limit = page_size or 100
+        take = -1 if limit is None else limit + 1
+        results = list(self._select(filter_payload, sorts, offset, take))
+        has_more = limit is not None and len(results) > limit
+        results = results[:limit] if limit is not None else results
+        return {
+            "object": "list",
+            "results": results,
+            "has_more": has_more,
+            "next_cursor": f"{CURSOR_PREFIX}{offset + len(results)}" if has_more else None,
+            "_meta": self.freshness(),
+        }
+
+    async def iter_rows(
+        self,
+        filter_payload: Optional[Dict[str, Any]] = None,
+        sorts: Optional[List[Dict[str, Any]]] = None,
+        limit: Optional[int] = None,
+        start_cursor: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        self.local_queries += 1
+        offset = self._offset(start_cursor)
+        for row in self._select(filter_payload, sorts, offset, -1 if limit is None else limit):
+            yield row
+
+    def stats(self) -> Dict[str, Any]:
+        (rows,) = self.db.execute("SELECT count(*) FROM pages").fetchone() if self.db else (0,)
+        return {
+            **self.freshness(),
+            "fresh": self.fresh,
+            "rows": rows,
+            "last_full_sync": _iso(self.last_full_sync) if self.last_full_sync else None,
+            "local_queries": self.local_queries,
+            "sync_errors": self.sync_errors,
+        }
+
+
+def _from_env() -> Optional[DatabaseMirror]:
+    database_id = os.getenv("NOTION_DATABASE_ID")
+    if not MIRROR_PATH or not database_id:
+        return None
+    return DatabaseMirror(MIRROR_PATH, database_id)
+
+
+mirror = _from_env()
@@ -2,14 +2,30 @@
 """Асинхронный клиент Notion API для MCP-серверa."""
 
 import os
-from typing import Dict, Any
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+import sqlite3
+from collections import deque
+from datetime import datetime
+from contextvars import ContextVar
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable
+from urllib.parse import urlencode
 
 import httpx
 from dotenv import load_dotenv
 
+from cache import Freshness, TTLCache
+from disk_cache import DiskCache
+
 load_dotenv()
 
-BASE = "https://api.notion.com/v1"
+logger = logging.getLogger(__name__)
+
+BASE = os.getenv("NOTION_BASE_URL", "https://api.notion.com/v1")
 HEADERS = {
     "Authorization": f"Bearer {os.getenv('NOTION_API_KEY')}",
     "Notion-Version": "2022-06-28",
@@ -17,20 +33,956 @@ HEADERS = {
 }
 
 
-async def _post(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.post(url, headers=HEADERS, json=payload)
-    return r.json()
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# ---------- транспорт ----------
+# Настройки пула соединений; значения по умолчанию рассчитаны на один
+# процесс uvicorn и лимит Notion около 3 запросов в секунду.
+TIMEOUT = _env_float("NOTION_TIMEOUT", 10.0)
+MAX_CONNECTIONS = _env_int("NOTION_MAX_CONNECTIONS", 20)
+MAX_KEEPALIVE_CONNECTIONS = _env_int("NOTION_MAX_KEEPALIVE_CONNECTIONS", 10)
+KEEPALIVE_EXPIRY = _env_float("NOTION_KEEPALIVE_EXPIRY", 30.0)
+# HTTP/2: "1" — согласование через ALPN с откатом на HTTP/1.1,
+# "h2c" — HTTP/2 без TLS с заранее известной поддержкой (локальные
+# прокси и mock-серверы). Требует пакет ``h2`` (``httpx[http2]``).
+HTTP2 = os.getenv("NOTION_HTTP2", "").lower()
+
+_client: httpx.AsyncClient | None = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    versions: Dict[str, bool] = {}
+    if HTTP2 in ("1", "true", "yes", "h2c"):
+        if _http2_available():
+            versions["http2"] = True
+            if HTTP2 == "h2c":
+                versions["http1"] = False
+        else:
+            logger.warning("NOTION_HTTP2 is set but h2 is not installed, falling back to HTTP/1.1")
+    return httpx.AsyncClient(headers=HEADERS, timeout=TIMEOUT, limits=limits, **versions)
+
+
+async def init_client() -> httpx.AsyncClient:
+    """Создать общий HTTP-клиент с пулом соединений.
+
+    Вызывается из lifespan FastAPI при старте сервера. Повторный вызов
+    возвращает уже созданный клиент.
+    """
+    return get_client()
+
+
+async def close_client() -> None:
+    """Закрыть общий HTTP-клиент и освободить соединения пула."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Вернуть общий HTTP-клиент.
+
+    Если lifespan не запускался (например, модуль используется из
+    скрипта), клиент создаётся лениво при первом обращении.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+# ---------- планировщик ----------
+# Notion допускает в среднем около 3 запросов в секунду на интеграцию.
+RATE_LIMIT = _env_float("NOTION_RATE_LIMIT", 3.0)
+RATE_BURST = _env_int("NOTION_RATE_BURST", 3)
+RATE_LIMIT_RETRIES = _env_int("NOTION_RATE_LIMIT_RETRIES", 5)
+
+
+class RateLimiter:
+    """Token bucket с честной очередью для всех запросов к Notion.
+
+    Запросы сверх лимита ждут своей очереди в порядке поступления
+    (``asyncio.Lock`` будит ожидающих по FIFO). Ответ 429 с заголовком
+    ``Retry-After`` приостанавливает выдачу токенов для всех запросов.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        # метрики
+        self.queued = 0
+        self.acquired = 0
+        self.cancelled = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Дождаться токена на один запрос."""
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._paused_until - now
+                    if delay <= 0:
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            break
+                        delay = (1 - self._tokens) / self.rate
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.queued -= 1
+        wait = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def pause(self, seconds: float) -> None:
+        """Приостановить выдачу токенов после ответа 429."""
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "queue_depth": self.queued,
+            "acquired": self.acquired,
+            "cancelled": self.cancelled,
+            "throttled": self.throttled,
+            "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+            "paused_for": max(self._paused_until - time.monotonic(), 0.0),
+        }
+
+
+scheduler = RateLimiter(RATE_LIMIT, RATE_BURST)
+
+
+def _retry_after(r: httpx.Response) -> float:
+    try:
+        return max(float(r.headers.get("Retry-After", "1")), 0.0)
+    except ValueError:
+        return 1.0
+
+
+# ---------- повторы ----------
+# Повторяются только чтения: у Notion нет ключей идемпотентности, и
+# запись, которая упала по таймауту или 5xx уже после применения,
+# при повторе создала бы дубликат. Задержка — экспоненциальная с
+# полным джиттером, общее время всех попыток ограничено ``RETRY_DEADLINE``.
+RETRY_ATTEMPTS = _env_int("NOTION_RETRY_ATTEMPTS", 4)
+RETRY_BASE_DELAY = _env_float("NOTION_RETRY_BASE_DELAY", 0.5)
+RETRY_MAX_DELAY = _env_float("NOTION_RETRY_MAX_DELAY", 8.0)
+RETRY_DEADLINE = _env_float("NOTION_RETRY_DEADLINE", 30.0)
+RETRYABLE_STATUSES = {409, 500, 502, 503, 504}
+
+
+class RetryStats:
+    """Счётчики повторов и задержки последних попыток."""
+
+    def __init__(self, size: int = 500) -> None:
+        self.attempts: deque = deque(maxlen=size)
+        self.retries = 0
+        self.gave_up = 0
+
+    def record(self, method: str, attempt: int, latency: float, outcome: str) -> None:
+        self.attempts.append(
+            {"method": method, "attempt": attempt, "latency": latency, "outcome": outcome}
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        by_attempt: Dict[int, list] = {}
+        for a in self.attempts:
+            by_attempt.setdefault(a["attempt"], []).append(a["latency"])
+        latency = {}
+        for attempt, values in sorted(by_attempt.items()):
+            values.sort()
+            latency[attempt] = {
+                "count": len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+            }
+        return {"retries": self.retries, "gave_up": self.gave_up, "latency_by_attempt": latency}
+
+
+retry_stats = RetryStats()
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def _send(method: str, url: str, payload: Dict[str, Any] | None) -> httpx.Response:
+    """Один запрос через планировщик; 429 ждёт Retry-After и повторяется.
+
+    Повтор после 429 безопасен и для записей: Notion их не применял.
+    """
+    for _ in range(RATE_LIMIT_RETRIES + 1):
+        await scheduler.acquire()
+        r = await get_client().request(method, url, json=payload)
+        if r.status_code != 429:
+            break
+        scheduler.pause(_retry_after(r))
+    return r
+
+
+async def _request_with_retries(
+    method: str,
+    url: str,
+    payload: Dict[str, Any] | None,
+    retryable: bool,
+) -> Dict[str, Any]:
+    deadline = time.monotonic() + RETRY_DEADLINE
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            r = await _send(method, url, payload)
+        except httpx.TransportError as exc:
+            retry_stats.record(method, attempt, time.monotonic() - started, type(exc).__name__)
+            error: Exception | None = exc
+        else:
+            retry_stats.record(method, attempt, time.monotonic() - started, str(r.status_code))
+            if r.status_code not in RETRYABLE_STATUSES:
+                return r.json()
+            error = None
+
+        attempt += 1
+        delay = _backoff(attempt)
+        if not retryable or attempt >= RETRY_ATTEMPTS or time.monotonic() + delay > deadline:
+            if retryable:
+                retry_stats.gave_up += 1
+            if error is not None:
+                raise error
+            return r.json()
+        retry_stats.retries += 1
+        await asyncio.sleep(delay)
+
+
+# ---------- объединение одинаковых запросов ----------
+class SingleFlight:
+    """Объединение одновременных одинаковых вызовов.
+
+    Пока вызов с данным ключом выполняется, все остальные вызывающие с
+    тем же ключом ждут его результат, а не порождают новый запрос.
+    Результат общий: вызывающие не должны изменять его на месте.
+    Общий запрос отменяется, только когда отменились все ожидающие.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is None:
+            self.calls += 1
+            fut = asyncio.ensure_future(factory())
+            self._inflight[key] = fut
+            self._waiters[key] = 0
+            fut.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self.coalesced += 1
+        self._waiters[key] += 1
+        try:
+            # shield: отмена одного из ожидающих не отменяет общий запрос
+            return await asyncio.shield(fut)
+        finally:
+            if not fut.done():
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    self.cancelled += 1
+                    # новые вызывающие не должны присоединиться к отменяемому запросу
+                    del self._inflight[key]
+                    del self._waiters[key]
+                    fut.cancel()
+
+    def _forget(self, key: str, fut: asyncio.Future) -> None:
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+            del self._waiters[key]
+        if not fut.cancelled():
+            fut.exception()  # помечаем исключение как полученное
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
+
+
+singleflight = SingleFlight()
+
+# Ключи идемпотентности записей проверяются локально: успешный ответ
+# запоминается, и повтор записи с тем же ключом (клиент не дождался
+# ответа и отправил команду снова) получает его, не обращаясь к Notion.
+IDEMPOTENCY_CACHE_SIZE = _env_int("NOTION_IDEMPOTENCY_CACHE_SIZE", 1024)
+IDEMPOTENCY_TTL = _env_float("NOTION_IDEMPOTENCY_TTL", 3600.0)
+
+idempotency_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+
+async def _write_once(method: str, url: str, payload: Dict[str, Any] | None, idempotency_key: str) -> Dict[str, Any]:
+    """Запись с ключом идемпотентности: не больше одного успешного применения."""
+    key = f"{method} {url} {idempotency_key}"
+    replay = idempotency_cache.get(key)
+    if replay is not None:
+        return replay
+
+    async def send() -> Dict[str, Any]:
+        result = await _request_with_retries(method, url, payload, retryable=False)
+        if result.get("object") != "error":
+            idempotency_cache.set(key, result)
+        return result
+
+    # одновременные повторы с тем же ключом ждут одну запись
+    return await singleflight.do(f"idempotency {key}", send)
+
+
+async def _request(
+    method: str,
+    url: str,
+    payload: Dict[str, Any] | None = None,
+    *,
+    idempotent: bool = False,
+    idempotency_key: str | None = None,
+) -> Dict[str, Any]:
+    if idempotency_key and not idempotent:
+        return await _write_once(method, url, payload, idempotency_key)
+    if not idempotent:
+        return await _request_with_retries(method, url, payload, retryable=False)
+    # одинаковые чтения (метод + URL + тело) разделяют один запрос к Notion
+    key = f"{method} {url} {json.dumps(payload, sort_keys=True)}"
+    return await singleflight.do(key, lambda: _request_with_retries(method, url, payload, retryable=True))
+
+
+async def _get(url: str) -> Dict[str, Any]:
+    return await _request("GET", url, idempotent=True)
+
+
+async def _post(url: str, payload: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    return await _request("POST", url, payload, **kwargs)
+
+
+async def _patch(url: str, payload: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    return await _request("PATCH", url, payload, **kwargs)
+
+
+async def _delete(url: str) -> Dict[str, Any]:
+    return await _request("DELETE", url)
+
+
+# ---------- прогресс ----------
+# Подписчик на ход длинных операций для текущего вызова (например,
+# отправка уведомлений MCP ``notifications/progress`` в SSE-поток).
+progress_callback: ContextVar[Callable[[str, Dict[str, Any]], None] | None] = ContextVar(
+    "progress_callback", default=None
+)
+
+
+def report_progress(message: str, **details: Any) -> None:
+    """Сообщить о ходе операции подписчику, если он есть.
+
+    ``done`` в ``details`` — монотонно растущий счётчик выполненной
+    работы, ``total`` — её полный объём, если он известен заранее.
+    """
+    callback = progress_callback.get()
+    if callback is not None:
+        callback(message, details)
+
+
+# ---------- пагинация ----------
+PAGE_SIZE_MAX = 100
+
+
+class NotionError(Exception):
+    """Ошибка Notion API внутри постраничного обхода.
+
+    Обычные функции возвращают тело ошибки Notion как есть; генераторы
+    не могут этого сделать и поднимают исключение с тем же телом.
+    """
+
+    def __init__(self, response: Dict[str, Any]) -> None:
+        super().__init__(response.get("message") or response.get("error") or "Notion API error")
+        self.response = response
+
+
+async def _paginate(
+    method: str,
+    url: str,
+    payload: Dict[str, Any] | None = None,
+    *,
+    page_size: int = PAGE_SIZE_MAX,
+    limit: int | None = None,
+    start_cursor: str | None = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Пройти по курсорам Notion, выдавая каждую страницу списка.
+
+    Для GET параметры пагинации передаются в строке запроса, для POST —
+    в теле. Обход останавливается, когда ``has_more`` ложно или набрано
+    ``limit`` записей.
+    """
+    cursor = start_cursor
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = min(page_size, PAGE_SIZE_MAX) if remaining is None else min(page_size, PAGE_SIZE_MAX, remaining)
+        params: Dict[str, Any] = {"page_size": size}
+        if cursor:
+            params["start_cursor"] = cursor
+        if method == "GET":
+            data = await _request("GET", f"{url}?{urlencode(params)}", idempotent=True)
+        else:
+            data = await _request(method, url, {**(payload or {}), **params}, idempotent=True)
+        if data.get("object") != "list":
+            raise NotionError(data)
+        _notify_objects(data.get("results", []))
+        if remaining is not None:
+            data = {**data, "results": data.get("results", [])[:remaining]}
+            remaining -= len(data["results"])
+        yield data
+        cursor = data.get("next_cursor")
+        if not data.get("has_more") or not cursor:
+            return
+
+
+async def _rows(pages: AsyncIterator[Dict[str, Any]], report: bool = True) -> AsyncIterator[Dict[str, Any]]:
+    """Развернуть страницы списка в поток отдельных записей."""
+    fetched = 0
+    async for page in pages:
+        fetched += len(page.get("results", []))
+        if report:
+            report_progress(f"fetched {fetched} items", done=fetched, has_more=bool(page.get("has_more")))
+        for row in page.get("results", []):
+            yield row
+
+
+async def _collect(pages: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Склеить страницы списка в один ответ в формате Notion."""
+    results: list[Dict[str, Any]] = []
+    last: Dict[str, Any] = {}
+    try:
+        async for last in pages:
+            results.extend(last.get("results", []))
+            report_progress(
+                f"fetched {len(results)} items", done=len(results), has_more=bool(last.get("has_more"))
+            )
+    except NotionError as exc:
+        return exc.response
+    return {
+        "object": "list",
+        "results": results,
+        "has_more": bool(last.get("has_more")),
+        "next_cursor": last.get("next_cursor"),
+    }
+
+
+# ---------- кэш страниц ----------
+PAGE_CACHE_SIZE = _env_int("NOTION_PAGE_CACHE_SIZE", 512)
+PAGE_CACHE_TTL = _env_float("NOTION_PAGE_CACHE_TTL", 60.0)
+PAGE_FRESHNESS = Freshness.of(
+    PAGE_CACHE_TTL,
+    _env_float("NOTION_PAGE_STALE_TTL", 300.0),
+    _env_float("NOTION_PAGE_MAX_STALE", 3600.0),
+)
+
+# Записи живут до max_stale; что с ними делать, решает политика свежести.
+page_cache = TTLCache(PAGE_CACHE_SIZE, PAGE_FRESHNESS.max_stale)
+
+
+def _norm_id(object_id: str) -> str:
+    """Привести ID Notion к одному виду (без дефисов, в нижнем регистре)."""
+    return object_id.replace("-", "").lower()
+
+
+# ---------- отсутствующие объекты ----------
+# Ответы 404 object_not_found и 403 restricted_resource запоминаются
+# ненадолго по ID объекта и коду ошибки: агенты часто повторяют запросы
+# к таким ID, и каждый повтор тратит лимит Notion впустую. В ключ входит
+# и вид эндпоинта: ID блока, запрошенный как страница, тоже даёт 404.
+NEGATIVE_CACHE_SIZE = _env_int("NOTION_NEGATIVE_CACHE_SIZE", 1024)
+NEGATIVE_CACHE_TTL = _env_float("NOTION_NEGATIVE_CACHE_TTL", 30.0)
+_NEGATIVE_CODES = ("object_not_found", "restricted_resource")
+_NEGATIVE_KINDS = ("page", "database", "block")
+
+negative_cache = TTLCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+
+
+def _known_missing(kind: str, object_id: str) -> Dict[str, Any] | None:
+    """Запомненная ошибка Notion для объекта или ``None``."""
+    key = _norm_id(object_id)
+    for code in _NEGATIVE_CODES:
+        entry = negative_cache.get_entry((kind, key, code))
+        if entry is not None:
+            return {**entry[0], "_meta": {"source": "negative_cache", "age": round(entry[1], 3)}}
+    return None
+
+
+def _remember_missing(kind: str, object_id: str, result: Dict[str, Any]) -> None:
+    if result.get("object") == "error" and result.get("code") in _NEGATIVE_CODES:
+        negative_cache.set((kind, _norm_id(object_id), result["code"]), result)
+
+
+def _forget_missing(*object_ids: str | None) -> None:
+    """Объекты могли стать доступными (созданы, восстановлены)."""
+    for object_id in object_ids:
+        if object_id:
+            for kind in _NEGATIVE_KINDS:
+                for code in _NEGATIVE_CODES:
+                    negative_cache.invalidate((kind, _norm_id(object_id), code))
+
+
+async def _get_object(kind: str, object_id: str) -> Dict[str, Any]:
+    """GET /{kind}s/{object_id} с учётом запомненных ошибок доступа."""
+    missing = _known_missing(kind, object_id)
+    if missing is not None:
+        return missing
+    result = await _get(f"{BASE}/{kind}s/{object_id}")
+    _remember_missing(kind, object_id, result)
+    return result
+
+
+# ---------- кэш на диске ----------
+# Необязательный второй уровень кэша для страниц, схем баз и дочерних
+# блоков: после перезапуска ответы берутся с диска, пока не истёк их TTL.
+DISK_CACHE_PATH = os.getenv("NOTION_DISK_CACHE_PATH")
+DISK_CACHE_MAX_BYTES = _env_int("NOTION_DISK_CACHE_MAX_MB", 64) * 1024 * 1024
+BLOCK_CACHE_TTL = _env_float("NOTION_BLOCK_CACHE_TTL", 60.0)
+
+disk_cache = DiskCache(DISK_CACHE_PATH, DISK_CACHE_MAX_BYTES) if DISK_CACHE_PATH else None
+
+
+def _disk_get(
+    kind: str, key: str, max_age: float, last_edited_time: str | None = None
+) -> tuple[Any, float] | None:
+    if disk_cache is None:
+        return None
+    try:
+        return disk_cache.get(kind, key, max_age, last_edited_time)
+    except sqlite3.Error:
+        logger.exception("disk cache read failed")
+        return None
+
+
+def _disk_set(kind: str, key: str, value: Dict[str, Any]) -> None:
+    if disk_cache is None:
+        return
+    try:
+        disk_cache.set(kind, key, value, value.get("last_edited_time"))
+    except sqlite3.Error:
+        logger.exception("disk cache write failed")
+
+
+def _disk_invalidate(kind: str, key: str) -> None:
+    if disk_cache is None:
+        return
+    try:
+        disk_cache.invalidate(kind, key)
+    except sqlite3.Error:
+        logger.exception("disk cache write failed")
+
+
+# Подписчики на изменения страниц, сделанные через этот сервер
+# (например, локальная копия базы); получают объект, который вернул Notion.
+_page_listeners: list[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_page_listener(listener: Callable[[Dict[str, Any]], None]) -> None:
+    _page_listeners.append(listener)
+
+
+def _notify_page(result: Dict[str, Any]) -> None:
+    if result.get("object") not in ("page", "block"):
+        return
+    # созданный или восстановленный объект и его родитель теперь доступны
+    parent = result.get("parent") or {}
+    parent_id = parent.get(parent.get("type"))
+    _forget_missing(result.get("id"), parent_id if isinstance(parent_id, str) else None)
+    # любая запись может изменить результаты запросов к базам
+    query_cache.clear()
+    for listener in _page_listeners:
+        try:
+            listener(result)
+        except Exception:
+            logger.exception("page listener failed")
+
+
+# Подписчики на объекты (страницы, базы, блоки), прочитанные из Notion
+# или созданные через этот сервер, например локальный поисковый индекс.
+_object_listeners: list[Callable[[list[Dict[str, Any]]], None]] = []
+
+
+def add_object_listener(listener: Callable[[list[Dict[str, Any]]], None]) -> None:
+    _object_listeners.append(listener)
+
+
+def _notify_objects(objects: list[Dict[str, Any]]) -> None:
+    if not objects:
+        return
+    for listener in _object_listeners:
+        try:
+            listener(objects)
+        except Exception:
+            logger.exception("object listener failed")
+
+
+def _remember_page(page_id: str, result: Dict[str, Any]) -> None:
+    """Обновить кэш после записи: свежий объект страницы или инвалидация."""
+    if result.get("object") == "page":
+        page_cache.replace(_norm_id(page_id), result)
+        _disk_set("page", _norm_id(page_id), result)
+        _notify_page(result)
+    else:
+        page_cache.invalidate(_norm_id(page_id))
+        _disk_invalidate("page", _norm_id(page_id))
+
+
+# ---------- stale-while-revalidate ----------
+QUERY_CACHE_SIZE = _env_int("NOTION_QUERY_CACHE_SIZE", 64)
+QUERY_FRESHNESS = Freshness.of(
+    _env_float("NOTION_QUERY_CACHE_TTL", 5.0),
+    _env_float("NOTION_QUERY_STALE_TTL", 30.0),
+    _env_float("NOTION_QUERY_MAX_STALE", 300.0),
+)
+
+query_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_FRESHNESS.max_stale)
+
+
+class Revalidator:
+    """Фоновое перечитывание устаревших записей, не больше одного на ключ."""
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.deduplicated = 0
+        self.failed = 0
+
+    def schedule(self, key: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        if key in self._tasks:
+            self.deduplicated += 1
+            return
+        self.started += 1
+        # пустой контекст: фоновое чтение не шлёт прогресс клиенту,
+        # чей запрос его запустил, и не отменяется вместе с этим запросом
+        self._tasks[key] = asyncio.get_running_loop().create_task(
+            self._run(key, factory), context=contextvars.Context()
+        )
+
+    async def _run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            await factory()
+        except Exception:
+            self.failed += 1
+            logger.warning("background revalidation of %s failed", key, exc_info=True)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def close(self) -> None:
+        """Отменить фоновые чтения при остановке сервера."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._tasks),
+            "started": self.started,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+        }
+
+
+revalidator = Revalidator()
+
+
+def _with_age(value: Dict[str, Any], age: float, stale: bool) -> Dict[str, Any]:
+    """Копия закэшированного ответа с ``_meta`` о его возрасте."""
+    return {**value, "_meta": {"source": "cache", "age": round(age, 3), "stale": stale}}
+
+
+def _is_transient(result: Dict[str, Any]) -> bool:
+    """Ошибка, при которой лучше отдать устаревший ответ, чем никакой."""
+    return result.get("object") == "error" and (result.get("status") == 429 or result.get("status", 0) >= 500)
+
+
+async def _cached_read(
+    name: str,
+    cache: TTLCache,
+    policy: Freshness,
+    key: str,
+    fetch: Callable[[], Awaitable[Dict[str, Any]]],
+    valid: Callable[[Dict[str, Any]], bool],
+    disk_kind: str | None = None,
+) -> Dict[str, Any]:
+    """Чтение через кэш по политике ``policy`` (stale-while-revalidate).
+
+    Ответ из кэша — копия с ``_meta``; свежий ответ Notion — как есть.
+    ``disk_kind`` включает второй уровень кэша на диске.
+    """
+    entry = cache.get_entry(key)
+    if entry is None and disk_kind is not None:
+        entry = _disk_get(disk_kind, key, policy.max_stale)
+        if entry is not None:
+            cache.set(key, entry[0], age=entry[1])
+
+    async def refresh() -> Dict[str, Any]:
+        generation = cache.generation(key)
+        result = await fetch()
+        if valid(result) and cache.set(key, result, generation):
+            if disk_kind is not None:
+                _disk_set(disk_kind, key, result)
+            if result.get("object") != "list":
+                _notify_objects([result])
+        return result
+
+    if entry is not None:
+        value, age = entry
+        state = policy.state(age)
+        if state == "fresh":
+            return _with_age(value, age, stale=False)
+        if state == "stale":
+            revalidator.schedule(f"{name}:{key}", refresh)
+            return _with_age(value, age, stale=True)
+    try:
+        result = await refresh()
+    except httpx.TransportError:
+        if entry is None:
+            raise
+        logger.warning("Notion unavailable, serving stale %s %s", name, key)
+        return _with_age(entry[0], entry[1], stale=True)
+    if entry is not None and _is_transient(result):
+        return _with_age(entry[0], entry[1], stale=True)
+    return result
+
+
+# ---------- содержимое страниц ----------
+# Полное содержимое страницы (дерево блоков, все дочерние блоки)
+# хранится вместе с last_edited_time страницы и отдаётся повторно, пока
+# страница не менялась: проверка стоит одного запроса вместо обхода.
+CONTENT_CACHE_SIZE = _env_int("NOTION_CONTENT_CACHE_SIZE", 32)
+# Notion округляет last_edited_time до минуты, поэтому правка в ту же
+# минуту, что и чтение, его не меняет; такому чтению верить нельзя.
+EDIT_TIME_RESOLUTION = 60.0
+
+content_cache = TTLCache(CONTENT_CACHE_SIZE, float("inf"))
+content_checks = {"unchanged": 0, "fetched": 0}
+
+# Источники last_edited_time страницы без запроса к Notion (например,
+# свежая локальная копия базы); возвращают None, если не знают ответа.
+_version_sources: list[Callable[[str], str | None]] = []
+
+
+def add_version_source(source: Callable[[str], str | None]) -> None:
+    _version_sources.append(source)
+
+
+async def _page_version(page_id: str) -> str | None:
+    """Текущий ``last_edited_time`` страницы или ``None``, если это не страница."""
+    key = _norm_id(page_id)
+    for source in _version_sources:
+        version = source(key)
+        if version:
+            return version
+    generation = page_cache.generation(key)
+    page = await _get_object("page", page_id)
+    if page.get("object") != "page":
+        return None
+    if page_cache.set(key, page, generation):
+        _disk_set("page", key, page)
+        _notify_objects([page])
+    return page.get("last_edited_time")
+
+
+def _edited_at(version: str) -> float:
+    return datetime.fromisoformat(version.replace("Z", "+00:00")).timestamp()
+
+
+async def _page_content(
+    page_id: str, key: str, load: Callable[[], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Содержимое страницы из кэша, если она не менялась, иначе ``load()``."""
+    version = await _page_version(page_id)
+    if version is None:
+        return await load()
+    # записи хранятся по версии страницы: другой last_edited_time — промах
+    entry = content_cache.get((key, version))
+    if entry is None:
+        stored = _disk_get("content", key, float("inf"), version)
+        entry = stored[0] if stored is not None else None
+    if entry is not None and entry["fetched_at"] >= _edited_at(version) + EDIT_TIME_RESOLUTION:
+        content_checks["unchanged"] += 1
+        content_cache.set((key, version), entry)
+        meta = {"source": "cache", "age": round(time.time() - entry["fetched_at"], 3), "last_edited_time": version}
+        return {**entry["content"], "_meta": meta}
+    content_checks["fetched"] += 1
+    fetched_at = time.time()
+    content = await load()
+    if content.get("object") == "list":
+        entry = {"last_edited_time": version, "fetched_at": fetched_at, "content": content}
+        content_cache.set((key, version), entry)
+        _disk_set("content", key, entry)
+    return content
+
+
+# ---------- схемы баз данных ----------
+SCHEMA_CACHE_SIZE = _env_int("NOTION_SCHEMA_CACHE_SIZE", 64)
+SCHEMA_CACHE_TTL = _env_float("NOTION_SCHEMA_CACHE_TTL", 300.0)
+SCHEMA_FRESHNESS = Freshness.of(
+    SCHEMA_CACHE_TTL,
+    _env_float("NOTION_SCHEMA_STALE_TTL", 3600.0),
+    _env_float("NOTION_SCHEMA_MAX_STALE", 86400.0),
+)
+
+schema_cache = TTLCache(SCHEMA_CACHE_SIZE, SCHEMA_FRESHNESS.max_stale)
+
+
+def restore_caches() -> int:
+    """Загрузить в память ещё свежие страницы и схемы из кэша на диске.
+
+    Вызывается при старте сервера, чтобы после перезапуска первые
+    запросы не уходили в Notion все разом. Возвращает число записей.
+    """
+    if disk_cache is None:
+        return 0
+    count = 0
+    for kind, cache in (("page", page_cache), ("database", schema_cache)):
+        for key, value, age in disk_cache.recent(kind, cache.ttl):
+            cache.set(key, value, age=age)
+            count += 1
+    return count
+
+
+# Ожидаемый тип значения свойства в теле запроса для каждого типа схемы.
+_PROPERTY_VALUE_TYPES: Dict[str, tuple] = {
+    "title": (list,),
+    "rich_text": (list,),
+    "number": (int, float, type(None)),
+    "checkbox": (bool,),
+    "date": (dict, type(None)),
+    "select": (dict, type(None)),
+    "status": (dict, type(None)),
+    "multi_select": (list,),
+    "people": (list,),
+    "relation": (list,),
+    "files": (list,),
+    "url": (str, type(None)),
+    "email": (str, type(None)),
+    "phone_number": (str, type(None)),
+}
+_READ_ONLY_TYPES = {
+    "formula",
+    "rollup",
+    "created_time",
+    "created_by",
+    "last_edited_time",
+    "last_edited_by",
+    "unique_id",
+}
+
+
+def validate_properties(schema: Dict[str, Any], properties: Dict[str, Any]) -> list[str]:
+    """Проверить значения свойств по схеме базы данных.
+
+    Возвращает список ошибок; пустой список означает, что Notion не
+    должен отклонить запрос из-за формы свойств. Проверяются имена
+    свойств, соответствие ключа значения типу свойства, тип значения,
+    свойства только для чтения и существование вариантов ``status``.
+    """
+    schema_props: Dict[str, Any] = schema.get("properties", {})
+    by_id = {prop.get("id"): prop for prop in schema_props.values()}
+    errors: list[str] = []
+    for name, value in properties.items():
+        prop = schema_props.get(name) or by_id.get(name)
+        if prop is None:
+            errors.append(f"{name}: no such property in database")
+            continue
+        prop_type = prop.get("type")
+        if prop_type in _READ_ONLY_TYPES:
+            errors.append(f"{name}: property of type {prop_type} is read-only")
+            continue
+        if not isinstance(value, dict) or prop_type not in value:
+            errors.append(f"{name}: expected an object with key {prop_type!r}")
+            continue
+        inner = value[prop_type]
+        expected = _PROPERTY_VALUE_TYPES.get(prop_type)
+        if expected and not isinstance(inner, expected):
+            errors.append(f"{name}: invalid {prop_type} value")
+            continue
+        if prop_type == "number" and isinstance(inner, bool):
+            errors.append(f"{name}: invalid number value")
+        elif prop_type == "status" and inner is not None:
+            options = {o.get("name") for o in prop.get("status", {}).get("options", [])}
+            if inner.get("name") is not None and inner["name"] not in options:
+                errors.append(f"{name}: unknown status option {inner['name']!r}")
+    return errors
 
 
-async def _patch(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.patch(url, headers=HEADERS, json=payload)
-    return r.json()
+async def _validate_for_database(database_id: str, properties: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Вернуть ответ с ошибкой, если свойства не проходят проверку схемой.
+
+    Если схему получить не удалось, проверка пропускается и решение
+    остаётся за Notion. Схема из кэша может не знать о недавно
+    добавленных свойствах и вариантах, поэтому перед отказом она
+    перечитывается из Notion.
+    """
+    schema = await retrieve_database(database_id)
+    if schema.get("object") != "database":
+        return None
+    errors = validate_properties(schema, properties)
+    if errors and "_meta" in schema:
+        schema = await retrieve_database(database_id, refresh=True)
+        if schema.get("object") != "database":
+            return None
+        errors = validate_properties(schema, properties)
+    if errors:
+        return {"error": "invalid properties", "details": errors}
+    return None
 
 
 # ---------- действия ----------
-async def create_page(title: str) -> Dict[str, Any]:
+async def create_page(title: str, idempotency_key: str | None = None) -> Dict[str, Any]:
     payload = {
         "parent": {"page_id": os.getenv("NOTION_PAGE_ID")},
         "properties": {
@@ -42,7 +994,9 @@ async def create_page(title: str) -> Dict[str, Any]:
             ]
         },
     }
-    return await _post(f"{BASE}/pages", payload)
+    result = await _post(f"{BASE}/pages", payload, idempotency_key=idempotency_key)
+    _notify_page(result)
+    return result
 
 
 async def create_task(p: Dict[str, Any]) -> Dict[str, Any]:
@@ -59,20 +1013,69 @@ async def create_task(p: Dict[str, Any]) -> Dict[str, Any]:
     if due_date:
         props["Due date"] = {"date": {"start": due_date}}
 
+    invalid = await _validate_for_database(db, props)
+    if invalid:
+        return invalid
+
     payload = {"parent": {"database_id": db}, "properties": props}
-    return await _post(f"{BASE}/pages", payload)
+    result = await _post(f"{BASE}/pages", payload, idempotency_key=p.get("idempotency_key"))
+    _notify_page(result)
+    return result
 
 
 async def update_page(p: Dict[str, Any]) -> Dict[str, Any]:
     page_id = p["page_id"]
     properties = p["properties"]
 
+    # База данных страницы известна, если её передали явно или страница
+    # уже есть в кэше; лишний запрос ради проверки не делаем.
+    database_id = p.get("database_id")
+    if not database_id:
+        cached = page_cache.peek(_norm_id(page_id)) or {}
+        database_id = cached.get("parent", {}).get("database_id")
+    if database_id:
+        invalid = await _validate_for_database(database_id, properties)
+        if invalid:
+            return invalid
+
     payload = {"properties": properties}
-    return await _patch(f"{BASE}/pages/{page_id}", payload)
+    result = await _patch(f"{BASE}/pages/{page_id}", payload, idempotency_key=p.get("idempotency_key"))
+    _remember_page(page_id, result)
+    return result
 
 # ----------- новые функции -----------
 
-async def query_database(filter_payload: Dict[str, Any] | None = None) -> Dict[str, Any]:
+def _database_query(
+    database_id: str,
+    filter_payload: Dict[str, Any] | None,
+    sorts: list[Dict[str, Any]] | None,
+    page_size: int,
+    limit: int | None,
+    start_cursor: str | None,
+) -> AsyncIterator[Dict[str, Any]]:
+    payload: Dict[str, Any] = {}
+    if filter_payload:
+        payload["filter"] = filter_payload
+    if sorts:
+        payload["sorts"] = sorts
+    return _paginate(
+        "POST",
+        f"{BASE}/databases/{database_id}/query",
+        payload,
+        page_size=page_size,
+        limit=limit,
+        start_cursor=start_cursor,
+    )
+
+
+async def query_database(
+    filter_payload: Dict[str, Any] | None = None,
+    sorts: list[Dict[str, Any]] | None = None,
+    page_size: int | None = None,
+    start_cursor: str | None = None,
+    fetch_all: bool = False,
+    limit: int | None = None,
+) -> Dict[str, Any]:
     """Запрос записей в базе данных Notion.
 
     Возвращает список страниц из базы данных, определённой переменной
@@ -84,27 +1087,84 @@ async def query_database(filter_payload: Dict[str, Any] | None = None) -> Dict[s
 
         {"property": "Due date", "date": {"equals": "2025-08-05"}}
 
+    По умолчанию возвращается одна страница результата (до
+    ``page_size`` записей, максимум 100). С ``fetch_all=True`` или
+    ``limit`` клиент сам проходит по ``next_cursor`` и склеивает
+    результаты; ``has_more``/``next_cursor`` в ответе позволяют
+    продолжить с места остановки.
+
+    Ответы кэшируются по политике ``QUERY_FRESHNESS`` (переменные
+    ``NOTION_QUERY_CACHE_TTL``, ``NOTION_QUERY_STALE_TTL``,
+    ``NOTION_QUERY_MAX_STALE``); ответ из кэша содержит ``_meta`` с его
+    возрастом. Любая запись через этот сервер сбрасывает кэш запросов.
+
     Если ``NOTION_DATABASE_ID`` не задан в окружении, возвращает
     словарь с ключом ``error``.
     """
     database_id = os.getenv("NOTION_DATABASE_ID")
     if not database_id:
         return {"error": "NOTION_DATABASE_ID not set"}
-    payload: Dict[str, Any] = {}
-    if filter_payload:
-        payload["filter"] = filter_payload
-    return await _post(f"{BASE}/databases/{database_id}/query", payload)
+    if not fetch_all and limit is None:
+        limit = page_size or PAGE_SIZE_MAX
+    key = json.dumps(
+        [_norm_id(database_id), filter_payload, sorts, page_size, start_cursor, limit], sort_keys=True
+    )
+
+    async def fetch() -> Dict[str, Any]:
+        pages = _database_query(
+            database_id, filter_payload, sorts, page_size or PAGE_SIZE_MAX, limit, start_cursor
+        )
+        return await _collect(pages)
+
+    return await _cached_read(
+        "query", query_cache, QUERY_FRESHNESS, key, fetch, lambda r: r.get("object") == "list"
+    )
+
+
+async def iter_database(
+    filter_payload: Dict[str, Any] | None = None,
+    sorts: list[Dict[str, Any]] | None = None,
+    page_size: int | None = None,
+    limit: int | None = None,
+    start_cursor: str | None = None,
+    database_id: str | None = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Асинхронно перебрать записи базы ``NOTION_DATABASE_ID``.
+
+    Следует по курсорам до конца базы или до ``limit`` записей и
+    выдаёт записи по одной, как только приходит очередная страница.
+    Ошибки Notion поднимаются как :class:`NotionError`. Другую базу
+    можно указать через ``database_id``.
+    """
+    database_id = database_id or os.getenv("NOTION_DATABASE_ID")
+    if not database_id:
+        raise NotionError({"error": "NOTION_DATABASE_ID not set"})
+    pages = _database_query(
+        database_id, filter_payload, sorts, page_size or PAGE_SIZE_MAX, limit, start_cursor
+    )
+    async for row in _rows(pages):
+        yield row
 
 
 async def retrieve_page(page_id: str) -> Dict[str, Any]:
     """Получить данные страницы Notion по её идентификатору.
 
     Использует эндпоинт GET /v1/pages/{page_id}. Возвращает JSON с
-    подробной информацией о странице и её свойствах.
+    подробной информацией о странице и её свойствах. Результат
+    кэшируется в памяти и, если задан ``NOTION_DISK_CACHE_PATH``, на
+    диске: первые ``NOTION_PAGE_CACHE_TTL`` секунд он отдаётся как
+    есть, до ``NOTION_PAGE_STALE_TTL`` — сразу с фоновым обновлением.
+    Изменения через этот сервер обновляют кэш сразу.
     """
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.get(f"{BASE}/pages/{page_id}", headers=HEADERS)
-    return r.json()
+    return await _cached_read(
+        "page",
+        page_cache,
+        PAGE_FRESHNESS,
+        _norm_id(page_id),
+        lambda: _get_object("page", page_id),
+        lambda r: r.get("object") == "page",
+        disk_kind="page",
+    )
 
 
 async def archive_page(page_id: str, archived: bool = True) -> Dict[str, Any]:
@@ -120,7 +1180,11 @@ async def archive_page(page_id: str, archived: bool = True) -> Dict[str, Any]:
     :return: объект страницы после обновления
     """
     payload = {"archived": archived}
-    return await _patch(f"{BASE}/pages/{page_id}", payload)
+    if not archived:
+        _forget_missing(page_id)
+    result = await _patch(f"{BASE}/pages/{page_id}", payload)
+    _remember_page(page_id, result)
+    return result
 
 
 async def delete_block(block_id: str) -> Dict[str, Any]:
@@ -130,57 +1194,429 @@ async def delete_block(block_id: str) -> Dict[str, Any]:
     Согласно документации Notion API, DELETE /blocks/{block_id} устанавливает
     ``archived`` на ``true``【348894490916182†L99-L105】.
     """
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.delete(f"{BASE}/blocks/{block_id}", headers=HEADERS)
-    return r.json()
+    # страница — тоже блок, поэтому кэш страницы сбрасывается
+    page_cache.invalidate(_norm_id(block_id))
+    _disk_invalidate("page", _norm_id(block_id))
+    result = await _delete(f"{BASE}/blocks/{block_id}")
+    parent = result.get("parent") or {}
+    if isinstance(parent.get(parent.get("type")), str):
+        _disk_invalidate("block_children", _norm_id(parent[parent["type"]]))
+    _notify_page(result)
+    return result
+
+
+# Лимиты Notion на один запрос добавления блоков.
+APPEND_CHUNK_SIZE = 100
+APPEND_MAX_ELEMENTS = 1000
+# Блоки, которые Notion создаёт только вместе с вложенным содержимым.
+_ATOMIC_BLOCK_TYPES = {"column_list"}
+
+
+def _block_children(block: Dict[str, Any]) -> list[Dict[str, Any]]:
+    body = block.get(block.get("type") or "")
+    return (body.get("children") or []) if isinstance(body, dict) else []
+
+
+def _count_blocks(block: Dict[str, Any]) -> int:
+    return 1 + sum(_count_blocks(c) for c in _block_children(block))
+
+
+def _prepare_block(block: Dict[str, Any]) -> tuple[Dict[str, Any], list[Dict[str, Any]]]:
+    """Оставить в блоке только то, что Notion примет в одном запросе.
+
+    В запросе допустимы два уровня вложенности и до 100 потомков на
+    уровень. Потомки-листья (до 100 штук) остаются внутри блока, всё,
+    начиная с первого потомка со своими детьми, откладывается и
+    добавляется отдельными запросами после создания блока.
+    """
+    children = _block_children(block)
+    if not children or block.get("type") in _ATOMIC_BLOCK_TYPES:
+        return block, []
+    inline = 0
+    while inline < min(len(children), APPEND_CHUNK_SIZE) and not _block_children(children[inline]):
+        inline += 1
+    if inline == len(children):
+        return block, []
+    block_type = block["type"]
+    body = {k: v for k, v in block[block_type].items() if k != "children"}
+    if inline:
+        body["children"] = children[:inline]
+    return {**block, block_type: body}, children[inline:]
 
 
-async def append_block_children(block_id: str, children: list[Dict[str, Any]]) -> Dict[str, Any]:
+def _chunk_blocks(children: list[Dict[str, Any]]) -> list[list[tuple[Dict[str, Any], list]]]:
+    """Разбить блоки на запросы не длиннее 100 блоков и 1000 элементов."""
+    chunks: list[list[tuple[Dict[str, Any], list]]] = []
+    current: list[tuple[Dict[str, Any], list]] = []
+    elements = 0
+    for block in children:
+        prepared, deferred = _prepare_block(block)
+        size = _count_blocks(prepared)
+        if current and (len(current) >= APPEND_CHUNK_SIZE or elements + size > APPEND_MAX_ELEMENTS):
+            chunks.append(current)
+            current, elements = [], 0
+        current.append((prepared, deferred))
+        elements += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def append_block_children(
+    block_id: str,
+    children: list[Dict[str, Any]],
+    idempotency_key: str | None = None,
+    after: str | None = None,
+) -> Dict[str, Any]:
     """Добавить дочерние блоки в конец блока.
 
     Использует PATCH /blocks/{block_id}/children. Список
     ``children`` должен быть массивом блоков в формате Notion API.
-    Максимум 100 блоков за раз.
+    Notion принимает максимум 100 блоков и два уровня вложенности за
+    раз, поэтому длинный список делится на части: каждая следующая
+    часть вставляется через ``after`` за последним блоком предыдущей,
+    а слишком глубокие потомки добавляются отдельными запросами к уже
+    созданным блокам параллельно с остальными частями.
+
+    ``after`` — ID блока, после которого вставить первую часть.
+    Возвращает список созданных блоков первого уровня и число
+    выполненных запросов; при ошибке — ответ Notion с полем
+    ``partial_results`` (уже добавленные блоки).
     """
-    payload = {"children": children}
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.patch(
-            f"{BASE}/blocks/{block_id}/children", headers=HEADERS, json=payload
+    progress = {"done": 0, "total": sum(_count_blocks(c) for c in children)}
+    _disk_invalidate("block_children", _norm_id(block_id))
+    return await _append_children(block_id, children, idempotency_key, after, progress)
+
+
+async def _append_children(
+    block_id: str,
+    children: list[Dict[str, Any]],
+    idempotency_key: str | None,
+    after: str | None,
+    progress: Dict[str, int],
+) -> Dict[str, Any]:
+    url = f"{BASE}/blocks/{block_id}/children"
+    results: list[Dict[str, Any]] = []
+    nested: list[asyncio.Future] = []
+    try:
+        error, requests = await _append_chunks(
+            url, children, idempotency_key, after, progress, results, nested
         )
-    return r.json()
+        responses = await asyncio.gather(*nested)
+    except BaseException:
+        # отмена (например, клиент отключился) останавливает и вложенные добавления
+        for task in nested:
+            task.cancel()
+        raise
 
+    for response in responses:
+        requests += response.get("requests", 0)
+        if error is None and response.get("object") != "list":
+            error = response
 
-async def retrieve_block_children(block_id: str) -> Dict[str, Any]:
+    if error is not None:
+        return {**error, "partial_results": results, "requests": requests}
+    return {"object": "list", "results": results, "requests": requests}
+
+
+async def _append_chunks(
+    url: str,
+    children: list[Dict[str, Any]],
+    idempotency_key: str | None,
+    after: str | None,
+    progress: Dict[str, int],
+    results: list[Dict[str, Any]],
+    nested: list[asyncio.Future],
+) -> tuple[Dict[str, Any] | None, int]:
+    """Последовательно отправить части; вложенные добавления — в ``nested``.
+
+    Возвращает ошибку Notion (если была) и число выполненных запросов.
+    """
+    requests = 0
+    for n, chunk in enumerate(_chunk_blocks(children)):
+        payload: Dict[str, Any] = {"children": [block for block, _ in chunk]}
+        if after:
+            payload["after"] = after
+        key = f"{idempotency_key}:{n}" if idempotency_key else None
+        response = await _patch(url, payload, idempotency_key=key)
+        requests += 1
+        if response.get("object") != "list":
+            return response, requests
+        created = response.get("results", [])
+        results.extend(created)
+        _notify_objects(created)
+        progress["done"] += sum(_count_blocks(block) for block, _ in chunk)
+        report_progress(
+            f"appended {progress['done']} of {progress['total']} blocks",
+            done=progress["done"],
+            total=progress["total"],
+        )
+        if created:
+            after = created[-1]["id"]
+        for i, (_, deferred) in enumerate(chunk):
+            if deferred and i < len(created):
+                nested_key = f"{idempotency_key}:{n}.{i}" if idempotency_key else None
+                nested.append(
+                    asyncio.ensure_future(
+                        _append_children(created[i]["id"], deferred, nested_key, None, progress)
+                    )
+                )
+    return None, requests
+
+
+async def _block_children_pages(
+    block_id: str, page_size: int | None, limit: int | None, start_cursor: str | None
+) -> AsyncIterator[Dict[str, Any]]:
+    missing = _known_missing("block", block_id)
+    if missing is not None:
+        raise NotionError(missing)
+    pages = _paginate(
+        "GET",
+        f"{BASE}/blocks/{block_id}/children",
+        page_size=page_size or PAGE_SIZE_MAX,
+        limit=limit,
+        start_cursor=start_cursor,
+    )
+    try:
+        async for page in pages:
+            yield page
+    except NotionError as exc:
+        _remember_missing("block", block_id, exc.response)
+        raise
+
+
+async def retrieve_block_children(
+    block_id: str,
+    page_size: int | None = None,
+    start_cursor: str | None = None,
+    fetch_all: bool = False,
+    limit: int | None = None,
+) -> Dict[str, Any]:
     """Получить дочерние блоки указанного блока.
 
     Выполняет GET /blocks/{block_id}/children и возвращает список
-    содержимого страницы или другого блока.
+    содержимого страницы или другого блока. Пагинация — как в
+    :func:`query_database`: ``fetch_all=True`` или ``limit`` включают
+    обход по курсорам.
+
+    Полный список детей (без ``start_cursor``) кэшируется на диске на
+    ``NOTION_BLOCK_CACHE_TTL`` секунд и отдаётся из кэша, если
+    целиком помещается в запрошенный объём. После этого при
+    ``fetch_all=True`` без ``limit`` для страницы сначала проверяется её
+    ``last_edited_time``, и если страница не менялась, обход не нужен.
     """
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.get(f"{BASE}/blocks/{block_id}/children", headers=HEADERS)
-    return r.json()
+    if not fetch_all and limit is None:
+        limit = page_size or PAGE_SIZE_MAX
+    key = _norm_id(block_id)
+    if start_cursor is None:
+        stored = _disk_get("block_children", key, BLOCK_CACHE_TTL)
+        if stored is not None and (limit is None or len(stored[0]["results"]) <= limit):
+            return stored[0]
 
+    async def load() -> Dict[str, Any]:
+        return await _collect(_block_children_pages(block_id, page_size, limit, start_cursor))
 
-async def retrieve_database(database_id: str) -> Dict[str, Any]:
-    """Получить свойства базы данных.
+    if fetch_all and start_cursor is None and limit is None:
+        # в кэше содержимого только полные списки: ответ с limit обрезан
+        result = await _page_content(block_id, f"children:{key}", load)
+    else:
+        result = await load()
+    if start_cursor is None and result.get("object") == "list" and not result["has_more"] and "_meta" not in result:
+        _disk_set("block_children", key, result)
+    return result
 
-    Эндпоинт GET /databases/{database_id} возвращает описание базы
-    данных и её свойства.
+
+async def iter_block_children(
+    block_id: str,
+    page_size: int | None = None,
+    limit: int | None = None,
+    start_cursor: str | None = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Асинхронно перебрать дочерние блоки, следуя по курсорам."""
+    async for block in _rows(_block_children_pages(block_id, page_size, limit, start_cursor)):
+        yield block
+
+
+# Параллельность обхода дерева; реальная частота запросов всё равно
+# ограничена планировщиком.
+BLOCK_TREE_CONCURRENCY = _env_int("NOTION_BLOCK_TREE_CONCURRENCY", 4)
+_CHILD_OBJECT_TYPES = {"child_page", "child_database"}
+
+
+def _flatten_tree(blocks: list[Dict[str, Any]], parent_id: str, depth: int, out: list) -> list:
+    for block in blocks:
+        children = block.pop("children", None)
+        out.append({**block, "parent_block_id": parent_id, "depth": depth})
+        if children:
+            _flatten_tree(children, block["id"], depth + 1, out)
+    return out
+
+
+async def retrieve_block_tree(
+    block_id: str,
+    max_depth: int | None = None,
+    concurrency: int | None = None,
+    flat: bool = False,
+    include_child_pages: bool = False,
+) -> Dict[str, Any]:
+    """Рекурсивно получить все вложенные блоки.
+
+    Каждый уровень читается целиком по курсорам, поддеревья соседних
+    блоков загружаются параллельно, но не более ``concurrency`` списков
+    одновременно. ``max_depth=1`` соответствует только прямым потомкам.
+    Вложенные страницы и базы (``child_page``/``child_database``) по
+    умолчанию не раскрываются.
+
+    Возвращает список в формате Notion: вложенное дерево, где потомки
+    лежат в поле ``children``, или при ``flat=True`` — плоский список в
+    порядке документа с полями ``parent_block_id`` и ``depth``.
+
+    Дерево страницы кэшируется вместе с её ``last_edited_time``: если
+    страница с тех пор не менялась, повторный обход не выполняется.
+    Вложенные страницы меняются независимо от родителя, поэтому с
+    ``include_child_pages=True`` кэш не используется.
     """
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.get(f"{BASE}/databases/{database_id}", headers=HEADERS)
-    return r.json()
 
+    async def walk() -> Dict[str, Any]:
+        return await _load_block_tree(block_id, max_depth, concurrency, flat, include_child_pages)
 
-async def search(query: str, filter: Dict[str, Any] | None = None, sort: Dict[str, Any] | None = None) -> Dict[str, Any]:
-    """Поиск по рабочему пространству Notion.
+    if include_child_pages:
+        return await walk()
+    key = json.dumps(["tree", _norm_id(block_id), max_depth, flat])
+    return await _page_content(block_id, key, walk)
 
-    Отправляет POST /search с текстовым запросом. Можно указать
-    фильтр и сортировку. Подробнее см. документацию Notion API.
+
+async def _load_block_tree(
+    block_id: str,
+    max_depth: int | None,
+    concurrency: int | None,
+    flat: bool,
+    include_child_pages: bool,
+) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency or BLOCK_TREE_CONCURRENCY)
+    count = 0
+    pending = 1
+
+    async def load(parent_id: str, depth: int) -> list[Dict[str, Any]]:
+        nonlocal count, pending
+        async with semaphore:
+            # копии: ответы Notion могут разделяться между вызывающими
+            pages = _block_children_pages(parent_id, None, None, None)
+            blocks = [dict(b) async for b in _rows(pages, report=False)]
+        count += len(blocks)
+        expand = [
+            b
+            for b in blocks
+            if b.get("has_children")
+            and (include_child_pages or b.get("type") not in _CHILD_OBJECT_TYPES)
+            and (max_depth is None or depth < max_depth)
+        ]
+        pending += len(expand) - 1
+        report_progress(
+            f"fetched {count} blocks, {pending} lists pending", done=count, pending=pending
+        )
+        tasks = [asyncio.ensure_future(load(b["id"], depth + 1)) for b in expand]
+        try:
+            subtrees = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        for block, children in zip(expand, subtrees):
+            block["children"] = children
+        return blocks
+
+    try:
+        tree = await load(block_id, 1)
+    except NotionError as exc:
+        return exc.response
+    results = _flatten_tree(tree, block_id, 1, []) if flat else tree
+    return {
+        "object": "list",
+        "type": "block_tree",
+        "block_id": block_id,
+        "format": "flat" if flat else "nested",
+        "block_count": count,
+        "results": results,
+    }
+
+
+async def retrieve_database(database_id: str, refresh: bool = False) -> Dict[str, Any]:
+    """Получить свойства базы данных.
+
+    Эндпоинт GET /databases/{database_id} возвращает описание базы
+    данных и её свойства. Схема кэшируется по политике
+    ``SCHEMA_FRESHNESS`` (``NOTION_SCHEMA_CACHE_TTL`` и соседние
+    переменные); ``refresh=True`` принудительно перечитывает её из Notion.
     """
+    key = _norm_id(database_id)
+    if refresh:
+        schema_cache.invalidate(key)
+        _disk_invalidate("database", key)
+    return await _cached_read(
+        "database",
+        schema_cache,
+        SCHEMA_FRESHNESS,
+        key,
+        lambda: _get_object("database", database_id),
+        lambda r: r.get("object") == "database",
+        disk_kind="database",
+    )
+
+
+def _search_payload(query: str, filter: Dict[str, Any] | None, sort: Dict[str, Any] | None) -> Dict[str, Any]:
     payload: Dict[str, Any] = {"query": query}
     if filter:
         payload["filter"] = filter
     if sort:
         payload["sort"] = sort
-    return await _post(f"{BASE}/search", payload)
+    return payload
+
+
+async def search(
+    query: str,
+    filter: Dict[str, Any] | None = None,
+    sort: Dict[str, Any] | None = None,
+    page_size: int | None = None,
+    start_cursor: str | None = None,
+    fetch_all: bool = False,
+    limit: int | None = None,
+) -> Dict[str, Any]:
+    """Поиск по рабочему пространству Notion.
+
+    Отправляет POST /search с текстовым запросом. Можно указать
+    фильтр и сортировку. Подробнее см. документацию Notion API.
+    Пагинация — как в :func:`query_database`.
+    """
+    if not fetch_all and limit is None:
+        limit = page_size or PAGE_SIZE_MAX
+    pages = _paginate(
+        "POST",
+        f"{BASE}/search",
+        _search_payload(query, filter, sort),
+        page_size=page_size or PAGE_SIZE_MAX,
+        limit=limit,
+        start_cursor=start_cursor,
+    )
+    return await _collect(pages)
+
+
+async def iter_search(
+    query: str,
+    filter: Dict[str, Any] | None = None,
+    sort: Dict[str, Any] | None = None,
+    page_size: int | None = None,
+    limit: int | None = None,
+    start_cursor: str | None = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Асинхронно перебрать результаты поиска, следуя по курсорам."""
+    pages = _paginate(
+        "POST",
+        f"{BASE}/search",
+        _search_payload(query, filter, sort),
+        page_size=page_size or PAGE_SIZE_MAX,
+        limit=limit,
+        start_cursor=start_cursor,
+    )
+    async for item in _rows(pages):
+        yield item
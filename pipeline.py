@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Многошаговые конвейеры MCP-команд с зависимостями между шагами.
+
+Конвейер — список шагов ``{"id", "action", "parameters", "depends_on"}``.
+Строковое значение параметра вида ``$steps[0].id`` или
+``$steps[create].results[0].id`` заменяется результатом (``data``)
+указанного шага, а сам шаг становится зависимым от него. Независимые
+ветви выполняются параллельно; после первой ошибки новые шаги не
+запускаются, а зависимые от неудачного шага помечаются ``skipped``.
+"""
+
+import re
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+_REF = re.compile(r"^\$steps\[([\w-]+)\]((?:\.[\w-]+|\[\d+\])*)$")
+_PATH = re.compile(r"\.([\w-]+)|\[(\d+)\]")
+
+Executor = Callable[[str, Dict[str, Any]], Awaitable[Any]]
+
+
+class PipelineError(ValueError):
+    """Некорректное описание конвейера: неизвестный шаг, цикл и т.п."""
+
+
+def _step_index(ref: str, names: Dict[str, int], count: int) -> int:
+    if ref.isdigit():
+        index = int(ref)
+        if index >= count:
+            raise PipelineError(f"reference to unknown step {ref}")
+        return index
+    if ref not in names:
+        raise PipelineError(f"reference to unknown step {ref!r}")
+    return names[ref]
+
+
+def _find_refs(value: Any, names: Dict[str, int], count: int) -> set:
+    if isinstance(value, str):
+        match = _REF.match(value)
+        return {_step_index(match.group(1), names, count)} if match else set()
+    if isinstance(value, dict):
+        return set().union(*(_find_refs(v, names, count) for v in value.values()))
+    if isinstance(value, list):
+        return set().union(*(_find_refs(v, names, count) for v in value))
+    return set()
+
+
+def _resolve(value: Any, outputs: List[Any], names: Dict[str, int]) -> Any:
+    if isinstance(value, str):
+        match = _REF.match(value)
+        if not match:
+            return value
+        current = outputs[_step_index(match.group(1), names, len(outputs))]
+        for key, index in _PATH.findall(match.group(2)):
+            try:
+                current = current[int(index)] if index else current[key]
+            except (KeyError, IndexError, TypeError):
+                raise PipelineError(f"{value}: path not found in step output") from None
+        return current
+    if isinstance(value, dict):
+        return {k: _resolve(v, outputs, names) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, outputs, names) for v in value]
+    return value
+
+
+def _is_error(data: Any) -> bool:
+    """Ответ Notion с ошибкой приходит как данные, а не исключение."""
+    return isinstance(data, dict) and (data.get("object") == "error" or "error" in data)
+
+
+def build_graph(steps: List[Dict[str, Any]]) -> List[set]:
+    """Вернуть зависимости каждого шага, проверив ссылки и отсутствие циклов."""
+    names: Dict[str, int] = {}
+    for i, step in enumerate(steps):
+        if not isinstance(step, dict) or not step.get("action"):
+            raise PipelineError(f"step {i}: action is required")
+        if step.get("id") is not None:
+            names[str(step["id"])] = i
+
+    deps: List[set] = []
+    for i, step in enumerate(steps):
+        refs = _find_refs(step.get("parameters", {}), names, len(steps))
+        depends_on = step.get("depends_on", [])
+        if not isinstance(depends_on, list):
+            raise PipelineError(f"step {i}: depends_on must be a list of step ids")
+        refs |= {_step_index(str(d), names, len(steps)) for d in depends_on}
+        if i in refs:
+            raise PipelineError(f"step {i} depends on itself")
+        deps.append(refs)
+
+    # проверка на циклы (алгоритм Кана)
+    indegree = [len(d) for d in deps]
+    ready = [i for i, n in enumerate(indegree) if n == 0]
+    visited = 0
+    while ready:
+        node = ready.pop()
+        visited += 1
+        for j, d in enumerate(deps):
+            if node in d:
+                indegree[j] -= 1
+                if indegree[j] == 0:
+                    ready.append(j)
+    if visited != len(steps):
+        raise PipelineError("pipeline contains a dependency cycle")
+    return deps
+
+
+async def run_pipeline(
+    steps: List[Dict[str, Any]], execute: Executor, concurrency: int = 10
+) -> Dict[str, Any]:
+    """Выполнить конвейер и вернуть результат каждого шага по порядку."""
+    deps = build_graph(steps)
+    names = {str(s["id"]): i for i, s in enumerate(steps) if s.get("id") is not None}
+    outputs: List[Any] = [None] * len(steps)
+    reports: List[Dict[str, Any]] = [
+        {"id": s.get("id", i), "action": s["action"], "status": "skipped"} for i, s in enumerate(steps)
+    ]
+    done = [asyncio.Event() for _ in steps]
+    failed = asyncio.Event()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_step(i: int) -> None:
+        try:
+            for d in deps[i]:
+                await done[d].wait()
+            if failed.is_set() or any(reports[d]["status"] != "ok" for d in deps[i]):
+                return
+            async with semaphore:
+                if failed.is_set():
+                    return
+                try:
+                    params = _resolve(steps[i].get("parameters", {}), outputs, names)
+                    data = await execute(steps[i]["action"], params)
+                except Exception as exc:
+                    reports[i].update(status="error", error=getattr(exc, "detail", None) or repr(exc))
+                    failed.set()
+                    return
+            outputs[i] = data
+            if _is_error(data):
+                reports[i].update(status="error", error=data)
+                failed.set()
+            else:
+                reports[i].update(status="ok", data=data)
+        finally:
+            done[i].set()
+
+    await asyncio.gather(*(run_step(i) for i in range(len(steps))))
+    return {"status": "error" if failed.is_set() else "ok", "steps": reports}
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Локальный полнотекстовый индекс (SQLite FTS5) по страницам и блокам.
+
+Индексируется всё, что сервер читает из Notion или записывает в него:
+страницы (заголовок и текстовые свойства), базы данных (название) и
+блоки (их текст). Архивированные объекты из индекса удаляются. Поиск
+ранжируется по BM25 (совпадение в заголовке весит больше) и возвращает
+фрагмент текста с подсвеченными словами.
+
+Индекс покрывает только то, что сервер уже видел, поэтому дополняет,
+а не заменяет ``search`` Notion. По умолчанию он хранится в памяти;
+``NOTION_SEARCH_INDEX_PATH`` задаёт файл, ``NOTION_SEARCH_INDEX=0``
+отключает индекс.
+
+Размер индекса ограничен: в нём не больше
+``NOTION_SEARCH_INDEX_MAX_OBJECTS`` объектов, при превышении удаляются
+те, что сервер дольше всего не видел. Объект, не встречавшийся
+``NOTION_SEARCH_INDEX_TTL`` секунд, тоже удаляется — так из поиска
+уходят страницы, удалённые в обход сервера. Цена ограничений — поиск
+не находит то, что давно не читалось, даже если оно есть в Notion.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from notion_client import _norm_id, add_object_listener, add_page_listener
+
+logger = logging.getLogger(__name__)
+
+INDEX_ENABLED = os.getenv("NOTION_SEARCH_INDEX", "1") != "0"
+INDEX_PATH = os.getenv("NOTION_SEARCH_INDEX_PATH", ":memory:")
+# Вес совпадения в заголовке относительно совпадения в тексте.
+TITLE_WEIGHT = 10.0
+SNIPPET_TOKENS = 16
+MAX_OBJECTS = int(os.getenv("NOTION_SEARCH_INDEX_MAX_OBJECTS", "20000"))
+INDEX_TTL = float(os.getenv("NOTION_SEARCH_INDEX_TTL", "86400"))
+# После вытеснения остаётся не больше этой доли лимита, чтобы не
+# вытеснять при каждой записи.
+_EVICT_TO = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    parent_id TEXT,
+    title TEXT NOT NULL,
+    url TEXT,
+    last_edited_time TEXT,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_seen ON objects(seen_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(
+    title, body, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Ближайшая страница или база над блоком — чтобы показать, где найдено.
+_CONTAINER = """
+WITH RECURSIVE up(id, parent_id, kind, title, depth) AS (
+    SELECT id, parent_id, kind, title, 0 FROM objects WHERE id = ?
+    UNION ALL
+    SELECT o.id, o.parent_id, o.kind, o.title, up.depth + 1
+    FROM objects o JOIN up ON o.id = up.parent_id
+    WHERE up.kind = 'block' AND up.depth < 32
+)
+SELECT id, title FROM up WHERE kind != 'block' ORDER BY depth LIMIT 1
+"""
+
+_TEXT_PROPERTY_TYPES = {"rich_text", "url", "email", "phone_number"}
+
+
+def _plain_text(items: Optional[List[Dict[str, Any]]]) -> str:
+    return "".join(i.get("plain_text") or i.get("text", {}).get("content", "") for i in items or [])
+
+
+def _parent_id(obj: Dict[str, Any]) -> Optional[str]:
+    parent = obj.get("parent") or {}
+    value = parent.get(parent.get("type"))
+    return _norm_id(value) if isinstance(value, str) else None
+
+
+def extract(obj: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """Вид объекта, заголовок и текст для индекса; ``None`` — не индексируется."""
+    kind = obj.get("object")
+    if kind == "page":
+        title, body = "", []
+        for prop in (obj.get("properties") or {}).values():
+            ptype = prop.get("type")
+            value = prop.get(ptype)
+            if ptype == "title":
+                title = _plain_text(value)
+            elif ptype == "rich_text":
+                body.append(_plain_text(value))
+            elif ptype in _TEXT_PROPERTY_TYPES and isinstance(value, str):
+                body.append(value)
+            elif ptype in ("select", "status") and value:
+                body.append(value["name"])
+            elif ptype == "multi_select":
+                body.extend(o["name"] for o in value or [])
+        return kind, title, "\n".join(t for t in body if t)
+    if kind == "database":
+        return kind, _plain_text(obj.get("title")), _plain_text(obj.get("description"))
+    if kind == "block":
+        content = obj.get(obj.get("type")) or {}
+        if "title" in content and isinstance(content["title"], str):
+            # child_page / child_database
+            return kind, content["title"], ""
+        text = _plain_text(content.get("rich_text"))
+        caption = _plain_text(content.get("caption"))
+        return kind, "", "\n".join(t for t in (text, caption) if t)
+    return None
+
+
+def _match_query(query: str) -> str:
+    """Запрос пользователя как выражение FTS5: все слова, последнее — по префиксу."""
+    words = [w.replace('"', '""') for w in query.split()]
+    terms = [f'"{w}"' for w in words]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class SearchIndex:
+    """Полнотекстовый индекс объектов Notion."""
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(objects)")}
+        if columns and "seen_at" not in columns:
+            # файл старого формата; индекс восстановится по мере чтения
+            self.db.executescript("DROP TABLE objects; DROP TABLE fts;")
+        self.db.executescript(_SCHEMA)
+        (self.size,) = self.db.execute("SELECT count(*) FROM objects").fetchone()
+        self.searches = 0
+        self.evictions = 0
+        add_object_listener(self.add)
+        add_page_listener(lambda result: self.add([result]))
+
+    def _upsert(self, obj: Dict[str, Any], now: float) -> None:
+        object_id = _norm_id(obj["id"])
+        if obj.get("archived") or obj.get("in_trash"):
+            self._remove(object_id)
+            return
+        extracted = extract(obj)
+        if extracted is None:
+            return
+        kind, title, body = extracted
+        row = (kind, _parent_id(obj), title, obj.get("url"), obj.get("last_edited_time"), now)
+        found = self.db.execute("SELECT rowid FROM objects WHERE id = ?", (object_id,)).fetchone()
+        if found is None:
+            rowid = self.db.execute(
+                "INSERT INTO objects (kind, parent_id, title, url, last_edited_time, seen_at, id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*row, object_id),
+            ).lastrowid
+            self.size += 1
+        else:
+            (rowid,) = found
+            self.db.execute(
+                "UPDATE objects SET kind = ?, parent_id = ?, title = ?, url = ?, last_edited_time = ?, seen_at = ? "
+                "WHERE id = ?",
+                (*row, object_id),
+            )
+            self.db.execute("DELETE FROM fts WHERE rowid = ?", (rowid,))
+        self.db.execute("INSERT INTO fts (rowid, title, body) VALUES (?, ?, ?)", (rowid, title, body))
+
+    def _remove(self, object_id: str) -> None:
+        found = self.db.execute("SELECT rowid FROM objects WHERE id = ?", (object_id,)).fetchone()
+        if found is not None:
+            self.db.execute("DELETE FROM fts WHERE rowid = ?", found)
+            self.db.execute("DELETE FROM objects WHERE rowid = ?", found)
+            self.size -= 1
+
+    def _prune(self, now: float) -> None:
+        """Удалить объекты старше ``INDEX_TTL`` и давно не виденные сверх лимита."""
+        cutoff = now - INDEX_TTL
+        victims = [r for (r,) in self.db.execute("SELECT rowid FROM objects WHERE seen_at < ?", (cutoff,))]
+        if self.size - len(victims) > MAX_OBJECTS:
+            excess = self.size - len(victims) - int(MAX_OBJECTS * _EVICT_TO)
+            victims += [
+                r
+                for (r,) in self.db.execute(
+                    "SELECT rowid FROM objects WHERE seen_at >= ? ORDER BY seen_at LIMIT ?", (cutoff, excess)
+                )
+            ]
+        if victims:
+            self.db.executemany("DELETE FROM fts WHERE rowid = ?", [(r,) for r in victims])
+            self.db.executemany("DELETE FROM objects WHERE rowid = ?", [(r,) for r in victims])
+            self.size -= len(victims)
+            self.evictions += len(victims)
+
+    def add(self, objects: Iterable[Dict[str, Any]]) -> None:
+        """Добавить или обновить объекты Notion одной транзакцией."""
+        now = time.time()
+        with self.db:
+            for obj in objects:
+                if isinstance(obj, dict) and obj.get("id"):
+                    self._upsert(obj, now)
+            self._prune(now)
+
+    def search(self, query: str, kind: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Найти объекты по словам запроса, лучшие совпадения первыми."""
+        self.searches += 1
+        with self.db:
+            self._prune(time.time())
+        match = _match_query(query)
+        if not match:
+            return {"object": "list", "results": []}
+        sql = (
+            "SELECT o.id, o.kind, o.title, o.url, o.last_edited_time, "
+            f"snippet(fts, -1, '**', '**', '…', {SNIPPET_TOKENS}), bm25(fts, {TITLE_WEIGHT}, 1.0) AS score "
+            "FROM fts JOIN objects o ON o.rowid = fts.rowid WHERE fts MATCH ?"
+        )
+        args: List[Any] = [match]
+        if kind:
+            sql += " AND o.kind = ?"
+            args.append(kind)
+        sql += " ORDER BY score LIMIT ?"
+        args.append(limit)
+        results = []
+        for object_id, obj_kind, title, url, edited, snippet, score in self.db.execute(sql, args).fetchall():
+            hit = {
+                "object": obj_kind,
+                "id": object_id,
+                "title": title,
+                "url": url,
+                "last_edited_time": edited,
+                "snippet": snippet,
+                "score": -score,
+            }
+            if obj_kind == "block":
+                container = self.db.execute(_CONTAINER, (object_id,)).fetchone()
+                hit["container"] = {"id": container[0], "title": container[1]} if container else None
+            results.append(hit)
+        return {"object": "list", "results": results}
+
+    def stats(self) -> Dict[str, Any]:
+        counts = dict(self.db.execute("SELECT kind, count(*) FROM objects GROUP BY kind"))
+        return {
+            "objects": counts,
+            "max_objects": MAX_OBJECTS,
+            "ttl": INDEX_TTL,
+            "searches": self.searches,
+            "evictions": self.evictions,
+        }
+
+
+search_index = SearchIndex(INDEX_PATH) if INDEX_ENABLED else None
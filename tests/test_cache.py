@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Защита TTLCache от устаревших чтений."""
+
+from cache import TTLCache
+
+
+def test_clear_discards_in_flight_read_of_unseen_key():
+    cache = TTLCache(maxsize=4, ttl=60)
+    generation = cache.generation("page")
+    cache.clear()
+    assert not cache.set("page", "stale", generation)
+    assert "page" not in cache
+
+
+def test_clear_discards_in_flight_read_of_known_key():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.invalidate("page")
+    generation = cache.generation("page")
+    cache.clear()
+    assert not cache.set("page", "stale", generation)
+
+
+def test_read_started_after_clear_is_stored():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.clear()
+    generation = cache.generation("page")
+    assert cache.set("page", "fresh", generation)
+    assert cache.get("page") == "fresh"
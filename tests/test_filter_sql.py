@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Сверка локальных фильтров и сортировок с ответами Notion.
+
+В ``fixtures/notion_queries.json`` — записи базы и запросы к ней с ID
+страниц в том порядке, в каком их вернул Notion. Записи загружаются в
+:class:`DatabaseMirror`, и тот же запрос должен дать те же ID в том же
+порядке. Запросы из ``unsupported`` копия обслуживать не должна — их
+отправляют в Notion.
+"""
+
+import json
+import time
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+import actions
+from mirror import DatabaseMirror
+
+FIXTURES = json.loads((Path(__file__).parent / "fixtures" / "notion_queries.json").read_text(encoding="utf-8"))
+
+
+@pytest.fixture(scope="module")
+def mirror():
+    mirror = DatabaseMirror(":memory:", FIXTURES["database_id"])
+    mirror.open()
+    for page in FIXTURES["pages"]:
+        mirror.upsert(page)
+    mirror.last_sync = time.time()
+    yield mirror
+    mirror.close()
+
+
+@pytest.mark.parametrize("case", FIXTURES["queries"], ids=lambda case: case["name"])
+def test_same_ids_as_notion(mirror, case):
+    assert mirror.can_serve(case["filter"], case["sorts"], None)
+    result = mirror.query(case["filter"], case["sorts"], fetch_all=True)
+    assert [page["id"] for page in result["results"]] == case["ids"]
+
+
+@pytest.mark.parametrize("case", FIXTURES["unsupported"], ids=lambda case: case["name"])
+def test_unsupported_goes_to_notion(mirror, case):
+    assert not mirror.can_serve(case["filter"], case["sorts"], None)
+
+
+def test_malformed_mirror_cursor_is_rejected(mirror, monkeypatch):
+    monkeypatch.setattr(actions, "mirror", mirror)
+    assert not mirror.can_serve(None, None, "mirror:x")
+    with pytest.raises(HTTPException) as exc:
+        actions._use_mirror(actions.QueryDatabaseParams(start_cursor="mirror:x"))
+    assert exc.value.status_code == 400
+
+
+def test_stale_mirror_cursor_is_not_sent_to_notion(mirror, monkeypatch):
+    monkeypatch.setattr(actions, "mirror", mirror)
+    params = actions.QueryDatabaseParams(start_cursor="mirror:2")
+    assert actions._use_mirror(params)
+    monkeypatch.setattr(mirror, "last_sync", time.time() - 24 * 3600)
+    with pytest.raises(HTTPException) as exc:
+        actions._use_mirror(params)
+    assert exc.value.status_code == 409
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Клиент Notion поверх подменённого транспорта httpx."""
+
+import asyncio
+
+import httpx
+import pytest
+
+import notion_client as nc
+from notion_client import RateLimiter, SingleFlight
+
+PAGE_ID = "0b6e4c2a-7d31-4f0e-8c55-0000000000aa"
+DATABASE_ID = "5c1f6a0e-2b7d-4c1e-9a43-3f1d2e8b7a10"
+SCHEMA = {
+    "object": "database",
+    "id": DATABASE_ID,
+    "properties": {
+        "Name": {"id": "title", "name": "Name", "type": "title", "title": {}},
+        "Priority": {"id": "p%3Fr", "name": "Priority", "type": "number", "number": {"format": "number"}},
+    },
+}
+BLOCKS = [
+    {"object": "block", "id": f"block-{i}", "type": "paragraph", "has_children": False, "paragraph": {"rich_text": []}}
+    for i in range(30)
+]
+
+
+def _notion(request: httpx.Request) -> httpx.Response:
+    path = request.url.path
+    if path.endswith(f"/databases/{DATABASE_ID}"):
+        return httpx.Response(200, json=SCHEMA)
+    if request.method == "PATCH" and path.endswith(f"/pages/{PAGE_ID}"):
+        return httpx.Response(200, json={"object": "page", "id": PAGE_ID, "properties": {}})
+    if path.endswith(f"/pages/{PAGE_ID}"):
+        return httpx.Response(
+            200, json={"object": "page", "id": PAGE_ID, "last_edited_time": "2024-01-01T10:00:00.000Z", "properties": {}}
+        )
+    if path.endswith(f"/blocks/{PAGE_ID}/children"):
+        size = int(request.url.params.get("page_size", 100))
+        start = int(request.url.params.get("start_cursor", 0))
+        end = min(start + size, len(BLOCKS))
+        return httpx.Response(
+            200,
+            json={
+                "object": "list",
+                "results": BLOCKS[start:end],
+                "has_more": end < len(BLOCKS),
+                "next_cursor": str(end) if end < len(BLOCKS) else None,
+            },
+        )
+    return httpx.Response(404, json={"object": "error", "status": 404, "code": "object_not_found", "message": path})
+
+
+@pytest.fixture
+def notion(monkeypatch):
+    monkeypatch.setattr(nc, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_notion), headers=nc.HEADERS))
+    monkeypatch.setattr(nc, "scheduler", RateLimiter(1000.0, 1000))
+    monkeypatch.setattr(nc, "disk_cache", None)
+    for cache in (nc.page_cache, nc.negative_cache, nc.content_cache, nc.schema_cache):
+        cache.clear()
+    yield nc
+
+
+def test_block_children_limit_is_not_served_from_full_list(notion):
+    async def run():
+        limited = await notion.retrieve_block_children(PAGE_ID, page_size=5, fetch_all=True, limit=10)
+        full = await notion.retrieve_block_children(PAGE_ID, fetch_all=True)
+        return limited, full
+
+    limited, full = asyncio.run(run())
+    assert len(limited["results"]) == 10 and limited["has_more"]
+    assert len(full["results"]) == 30 and not full["has_more"]
+
+
+def test_block_children_full_list_does_not_exceed_limit(notion):
+    async def run():
+        await notion.retrieve_block_children(PAGE_ID, fetch_all=True)
+        return await notion.retrieve_block_children(PAGE_ID, fetch_all=True, limit=10)
+
+    limited = asyncio.run(run())
+    assert len(limited["results"]) == 10 and limited["has_more"]
+
+
+
+def test_update_rechecks_cached_schema_before_rejecting(notion):
+    # в закэшированной схеме ещё нет свойства, добавленного в Notion
+    old = {**SCHEMA, "properties": {"Name": SCHEMA["properties"]["Name"]}}
+    notion.schema_cache.set(nc._norm_id(DATABASE_ID), old)
+    update = {"page_id": PAGE_ID, "database_id": DATABASE_ID, "properties": {"Priority": {"number": 2}}}
+    result = asyncio.run(notion.update_page(update))
+    assert result["object"] == "page"
+
+
+def test_update_rejected_when_fresh_schema_disagrees(notion):
+    update = {"page_id": PAGE_ID, "database_id": DATABASE_ID, "properties": {"Nope": {"number": 2}}}
+    result = asyncio.run(notion.update_page(update))
+    assert result["error"] == "invalid properties"
+
+
+def test_singleflight_cancelled_call_is_not_joined():
+    async def run():
+        flight = SingleFlight()
+
+        async def work(name):
+            await asyncio.sleep(0.01)
+            return name
+
+        first = asyncio.ensure_future(flight.do("k", lambda: work("first")))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        # общий запрос отменён, но ещё не завершён: новый вызов не должен к нему присоединиться
+        second = await flight.do("k", lambda: work("second"))
+        return first, second, flight
+
+    first, second, flight = asyncio.run(run())
+    assert first.cancelled()
+    assert second == "second"
+    assert flight.stats()["inflight"] == 0
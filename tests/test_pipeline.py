@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Проверка графа зависимостей конвейера."""
+
+import pytest
+
+from pipeline import PipelineError, build_graph
+
+
+def _steps(depends_on):
+    return [
+        {"id": "a", "action": "retrieve_page"},
+        {"id": "b", "action": "retrieve_page"},
+        {"id": "ab", "action": "retrieve_page", "depends_on": depends_on},
+    ]
+
+
+def test_depends_on_list_of_ids():
+    assert build_graph(_steps(["a", "b"]))[2] == {0, 1}
+
+
+@pytest.mark.parametrize("depends_on", ["ab", "a", {"a": 1}, 0])
+def test_depends_on_must_be_a_list(depends_on):
+    # строка не должна читаться как список своих символов
+    with pytest.raises(PipelineError, match="depends_on must be a list"):
+        build_graph(_steps(depends_on))
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(PipelineError):
+        build_graph(_steps(["c"]))
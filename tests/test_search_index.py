@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Ограничения размера и возраста локального поискового индекса."""
+
+import search_index
+from search_index import SearchIndex
+
+
+def _page(n):
+    return {
+        "object": "page",
+        "id": f"page-{n}",
+        "properties": {"Name": {"type": "title", "title": [{"plain_text": f"report {n}"}]}},
+    }
+
+
+def test_least_recently_seen_objects_are_evicted(monkeypatch):
+    monkeypatch.setattr(search_index, "MAX_OBJECTS", 10)
+    index = SearchIndex(":memory:")
+    for n in range(20):
+        index.add([_page(n)])
+    assert index.size <= 10
+    found = {hit["id"] for hit in index.search("report", limit=50)["results"]}
+    assert "page19" in found and "page0" not in found
+
+
+def test_objects_not_seen_within_ttl_are_dropped(monkeypatch):
+    index = SearchIndex(":memory:")
+    index.add([_page(1)])
+    assert index.search("report")["results"]
+    monkeypatch.setattr(search_index, "INDEX_TTL", -1.0)
+    assert index.search("report")["results"] == []
+    assert index.size == 0
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Прогрев кэшей после старта сервера.
+
+В фоне, через общий планировщик запросов, читаются схема базы
+``NOTION_DATABASE_ID``, первые ``NOTION_WARMUP_QUERY_PAGES`` страниц её
+записей и дерево блоков страницы ``NOTION_PAGE_ID``. Сервер отвечает на
+запросы и во время прогрева, а ``/ready`` сообщает, закончился ли он.
+Ошибка одного шага не останавливает остальные. ``NOTION_WARMUP=0``
+отключает прогрев.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from notion_client import query_database, retrieve_block_tree, retrieve_database
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("NOTION_WARMUP", "1") != "0"
+QUERY_PAGES = int(os.getenv("NOTION_WARMUP_QUERY_PAGES", "1"))
+
+
+async def _query_pages(pages: int) -> int:
+    """Прочитать первые ``pages`` страниц записей базы; вернуть число записей."""
+    rows, cursor = 0, None
+    for _ in range(pages):
+        result = await query_database(start_cursor=cursor)
+        if result.get("object") != "list":
+            raise RuntimeError(result)
+        rows += len(result["results"])
+        cursor = result.get("next_cursor")
+        if not result.get("has_more") or not cursor:
+            break
+    return rows
+
+
+async def _checked(call: Awaitable[Dict[str, Any]]) -> Dict[str, Any]:
+    result = await call
+    if result.get("object") == "error" or "error" in result:
+        raise RuntimeError(result)
+    return result
+
+
+class Warmup:
+    """Фоновый прогрев и его состояние для ``/ready`` и ``/stats``."""
+
+    def __init__(self, steps: List[Tuple[str, Callable[[], Awaitable[Any]]]]) -> None:
+        self.steps = steps
+        self.state = "pending"
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "done"
+
+    async def _step(self, name: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        started = time.monotonic()
+        try:
+            await factory()
+            self.results[name] = {"status": "ok"}
+        except Exception as exc:
+            logger.warning("warm-up step %s failed: %r", name, exc)
+            self.results[name] = {"status": "error", "error": repr(exc)}
+        self.results[name]["seconds"] = round(time.monotonic() - started, 3)
+
+    async def run(self) -> None:
+        self.state = "running"
+        self.started_at = time.monotonic()
+        await asyncio.gather(*(self._step(name, factory) for name, factory in self.steps))
+        self.finished_at = time.monotonic()
+        self.state = "done"
+        logger.info("warm-up finished in %.1fs", self.finished_at - self.started_at)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        end = self.finished_at or time.monotonic()
+        return {
+            "state": self.state,
+            "seconds": round(end - self.started_at, 3) if self.started_at else None,
+            "steps": self.results,
+        }
+
+
+def _from_env() -> Warmup:
+    steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+    if WARMUP_ENABLED:
+        database_id = os.getenv("NOTION_DATABASE_ID")
+        page_id = os.getenv("NOTION_PAGE_ID")
+        if database_id:
+            steps.append(("database_schema", lambda: _checked(retrieve_database(database_id))))
+            if QUERY_PAGES > 0:
+                steps.append(("database_query", lambda: _query_pages(QUERY_PAGES)))
+        if page_id:
+            steps.append(("page_block_tree", lambda: _checked(retrieve_block_tree(page_id))))
+    return Warmup(steps)
+
+
+warmup = _from_env()